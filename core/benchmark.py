@@ -0,0 +1,231 @@
+"""
+A synthetic page tree and timings of the public rendering paths, used by
+the benchmark management command.
+"""
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+import json
+import time
+import tracemalloc
+from wagtail.core.models import Site
+
+from core.models import Content
+
+WORDS = (
+    'account', 'backup', 'calendar', 'desktop', 'email', 'firewall', 'licence', 'mobile',
+    'network', 'password', 'printer', 'remote', 'server', 'software', 'storage', 'telephone',
+)
+TAGS = 20
+# Snippets include each other in chains of this length.
+SNIPPET_CHAIN = 3
+
+
+def page_body(i, snippets):
+    """The StreamField body of the ``i``th generated page: text, and an
+    include_content or content_list block on some pages.
+    """
+    words = ' '.join(WORDS[(i * 7 + n) % len(WORDS)] for n in range(40))
+    body = [
+        {'type': 'heading', 'value': 'Page {}'.format(i)},
+        {'type': 'rich_text', 'value': '<p>{}</p><p><a href="/">home</a> {}</p>'.format(words, words)},
+    ]
+    if snippets and i % 10 == 0:
+        body.append({'type': 'include_content', 'value': snippets[i % len(snippets)]})
+    if i % 25 == 0:
+        body.append({'type': 'content_list', 'value': json.dumps(
+            {'tags': 'tag-{}'.format(i % TAGS) if i % 50 else '', 'limit': 10})})
+    return json.dumps(body)
+
+
+def new_page(i, slug, body, level, menu_depth):
+    page = Content(
+        title='{} {}'.format(WORDS[i % len(WORDS)].title(), i), slug=slug, body=body,
+        show_in_menus=level <= menu_depth, search_description='Page {} about {}'.format(
+            i, WORDS[i % len(WORDS)]))
+    page.tags.add('tag-{}'.format(i % TAGS), 'tag-{}'.format((i * 3) % TAGS))
+    return page
+
+
+def publish(page):
+    """Give ``page`` a live revision, as publishing it does, without running
+    the publish signal handlers for each page (build_tree stores the
+    dependency index in bulk).
+    """
+    revision = page.save_revision()
+    Content.objects.filter(pk=page.pk).update(live_revision=revision, has_unpublished_changes=False)
+    return page
+
+
+def build_tree(pages, depth, fanout, snippets=30, menu_depth=2, log=None):
+    """
+    Add ``pages`` live Content pages under the default site's root page, in
+    a tree ``depth`` levels deep with up to ``fanout`` children per page
+    (more if the tree would otherwise run out of room), plus a snippets
+    section of pages included by others, and stores the dependency index of
+    the pages. Every page has a live revision, as the block and snippet
+    caches are keyed on it. Returns the number of pages created.
+    """
+    home = Site.objects.get(is_default_site=True).root_page
+    section = publish(home.add_child(instance=Content(title='Snippets', slug='snippets', body='[]')))
+    slugs = []
+    for k in range(snippets):
+        slug = 'snippet-{}'.format(k)
+        body = [{'type': 'rich_text', 'value': '<p>Snippet {} {}</p>'.format(k, WORDS[k % len(WORDS)])}]
+        if (k + 1) % SNIPPET_CHAIN and k + 1 < snippets:
+            body.append({'type': 'include_content', 'value': 'snippet-{}'.format(k + 1)})
+        publish(section.add_child(instance=Content(
+            title='Snippet {}'.format(k), slug=slug, body=json.dumps(body))))
+        slugs.append(slug)
+    # Chains start at every SNIPPET_CHAIN'th snippet.
+    heads = slugs[::SNIPPET_CHAIN]
+
+    # Pages are added a level at a time; home is level 0.
+    parents = [(home, 0)]
+    created = 0
+    while created < pages:
+        children = []
+        for parent, level in parents:
+            for n in range(fanout):
+                if created >= pages:
+                    break
+                page = publish(parent.add_child(instance=new_page(
+                    created, 'page-{}'.format(created), page_body(created, heads), level + 1, menu_depth)))
+                children.append((page, level + 1))
+                created += 1
+                if log and created % 1000 == 0:
+                    log('Created {} of {} pages'.format(created, pages))
+        if children[0][1] < depth:
+            parents = children
+        # Otherwise the tree is as deep as it may get, and the last level's
+        # parents get more children.
+
+    for page in Content.objects.all():
+        if page.include_slugs() or page.list_tags():
+            page.update_dependencies()
+    return created
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(name, call, runs, warmup=1):
+    """
+    Time ``runs`` calls of ``call(n)``, which makes the nth request, after
+    ``warmup`` untimed calls. Returns latency percentiles in milliseconds,
+    queries per call and the peak memory allocated by one call.
+    """
+    for n in range(warmup):
+        call(n)
+    timings, queries = [], []
+    for n in range(runs):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            call(warmup + n)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured.captured_queries))
+    # Tracing slows everything down, so memory is measured separately.
+    tracemalloc.start()
+    call(warmup + runs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'name': name,
+        'runs': runs,
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p90_ms': round(percentile(timings, 0.9), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'max_ms': round(max(timings), 2),
+        'queries_mean': round(sum(queries) / len(queries), 1),
+        'queries_max': max(queries),
+        'peak_memory_bytes': peak,
+    }
+
+
+def get(client, urls, status=None):
+    """Return a call requesting each of ``urls`` in turn, or ``urls(n)`` if
+    it is a function, and checking the response status.
+    """
+    def call(n):
+        url = urls(n) if callable(urls) else urls[n % len(urls)]
+        response = client.get(url)
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+        if status is not None and response.status_code != status:
+            raise AssertionError('{} returned {}'.format(url, response.status_code))
+        return response
+    return call
+
+
+def render_tags(pages):
+    """Return a call rendering the menu and breadcrumb tags for each of
+    ``pages`` in turn, outside of any page template.
+    """
+    template = Template(
+        '{% load core_tags %}{% get_site_root as site_root %}'
+        '{% f6_top_menu parent=site_root calling_page=self %}{% breadcrumbs self %}')
+    factory = RequestFactory()
+    site = Site.objects.get(is_default_site=True)
+
+    def call(n):
+        page = pages[n % len(pages)]
+        request = factory.get(page.url)
+        request.site = site
+        return template.render(Context({'request': request, 'self': page, 'page': page}))
+    return call
+
+
+def run_benchmarks(runs, samples=20, warmup=1, log=None):
+    """
+    Time the public endpoints against the pages in the database, sampling
+    up to ``samples`` URLs for each. Returns a list of results, see measure.
+    Run with NOTFOUND_SEARCH_RATE_LIMIT out of the way, as every request
+    comes from the same client.
+    """
+    client = Client()
+    depths = sorted(set(Content.objects.live().values_list('depth', flat=True)))
+    endpoints = []
+    for depth in depths:
+        pages = list(Content.objects.live().filter(depth=depth).exclude(
+            url_path__startswith='/home/snippets/').order_by('?')[:samples])
+        if pages and depth > 2:
+            endpoints.append(('serve:depth-{}'.format(depth - 2), get(client, [p.url for p in pages], 200)))
+            endpoints.append(('tags:depth-{}'.format(depth - 2), render_tags(pages)))
+
+    listing = list(Content.objects.live().filter(listed_tags__isnull=False).distinct()[:samples])
+    if listing:
+        endpoints.append(('serve:content_list', get(client, [p.url for p in listing], 200)))
+    including = list(Content.objects.live().filter(includes__isnull=False).exclude(
+        url_path__startswith='/home/snippets/').distinct()[:samples])
+    if including:
+        endpoints.append(('serve:include_content', get(client, [p.url for p in including], 200)))
+
+    endpoints.append(('search', get(client, ['/search?q={}'.format(word) for word in WORDS], 200)))
+    endpoints.append(('search:page-2', get(client, ['/search?q={}&page=2'.format(word) for word in WORDS], 200)))
+
+    # Missing page results are cached per path, so each request is for a new
+    # path, and the repeated paths are timed separately.
+    slugs = list(Content.objects.live().order_by('?').values_list('slug', flat=True)[:samples])
+    endpoints.append(('error404:slug', get(
+        client, lambda n: '/moved/{}/{}/'.format(n, slugs[n % len(slugs)]))))
+    endpoints.append(('error404:search', get(
+        client, lambda n: '/old/{}-{}/'.format(WORDS[n % len(WORDS)], n))))
+    endpoints.append(('error404:cached', get(client, [
+        '/old/{}-{}/'.format(word, n) for n, word in enumerate(WORDS)])))
+    endpoints.append(('error404:probe', get(client, ['/wp-login.php', '/.env', '/admin.php'], 404)))
+
+    drafts = list(Content.objects.live().exclude(url_path__startswith='/home/snippets/').order_by('?')[:samples])
+    for page in drafts:
+        page.save_revision()
+    endpoints.append(('draft', get(client, ['/draft{}'.format(p.url) for p in drafts])))
+
+    results = []
+    for name, call in endpoints:
+        result = measure(name, call, runs, warmup)
+        if log:
+            log('{name}: p50 {p50_ms} ms, p90 {p90_ms} ms, {queries_mean} queries'.format(**result))
+        results.append(result)
+    return results
@@ -0,0 +1,53 @@
+from django.utils.safestring import mark_safe
+
+from core.cache import FragmentCache
+from core.images import prefetched_renditions
+
+
+block_cache = FragmentCache('block')
+
+# Blocks rendered when the page is, rather than from the block cache.
+DYNAMIC_BLOCKS = ('include_content', 'content_list')
+
+
+def body_blocks(context, page):
+    """
+    Return ``(block, html)`` for each block in the body of ``page``, where
+    ``html`` is the rendered block from ``core/tags/block.html``, or None for
+    the dynamic blocks that are rendered with the page.
+
+    Rendered blocks are cached by page revision and block id, until a change
+    to a page URL, image or document that rich text may link to (see
+    core.signals). Previews, and pages without a live revision, aren't cached.
+    """
+    request = context.get('request')
+    blocks = list(page.body or []) if page else []
+    revision_id = getattr(page, 'live_revision_id', None)
+    cacheable = revision_id and not getattr(request, 'is_preview', False)
+    keys = {}
+    if cacheable:
+        for i, block in enumerate(blocks):
+            if block.block_type not in DYNAMIC_BLOCKS:
+                keys[i] = block_cache.make_key(request, page.pk, revision_id, block.id or i)
+    cached = block_cache.get_many(list(keys.values()))
+
+    template = context.template.engine.get_template('core/tags/block.html')
+    rendered, missed = [], {}
+    # Images in the rich text to be rendered are looked up together.
+    with prefetched_renditions([
+            block.value.source for i, block in enumerate(blocks)
+            if block.block_type == 'rich_text' and keys.get(i) not in cached]):
+        for i, block in enumerate(blocks):
+            if block.block_type in DYNAMIC_BLOCKS:
+                rendered.append((block, None))
+                continue
+            html = cached.get(keys.get(i))
+            if html is not None:
+                html = mark_safe(html)
+            else:
+                html = template.render(context.new({'block': block, 'request': request}))
+                if i in keys:
+                    missed[keys[i]] = html
+            rendered.append((block, html))
+    block_cache.set_many(missed)
+    return rendered
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F
+import hashlib
+
+
+fragment_caches = []
+
+
+def get_cache():
+    return caches[getattr(settings, 'CMS_CACHE_ALIAS', 'default')]
+
+
+def shared_cache():
+    """Whether the cache is shared between worker processes.
+    """
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def hash_key(value):
+    """A fixed-length cache key part for an arbitrary string, such as a URL
+    path, that may be too long for memcached or contain characters it
+    doesn't allow in keys.
+    """
+    return hashlib.md5(value.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def version_key(name):
+    return 'cms:version:{}'.format(name)
+
+
+def load_versions():
+    """
+    Return the current version of every fragment cache, in at most one cache
+    read and one database query.
+    """
+    from core.models import CacheVersion
+    versions = {}
+    names = [c.name for c in fragment_caches]
+    if shared_cache():
+        cached = get_cache().get_many([version_key(name) for name in names])
+        versions = {name: cached[version_key(name)] for name in names if version_key(name) in cached}
+    if len(versions) < len(names):
+        stored = dict(CacheVersion.objects.values_list('name', 'version'))
+        for name in names:
+            if name not in versions:
+                versions[name] = stored.get(name, 0)
+                if shared_cache():
+                    # add() never overwrites a version set by bump().
+                    get_cache().add(version_key(name), versions[name], None)
+    return versions
+
+
+def load_version(name):
+    """Return the current version of the cache ``name``, which need not be a
+    fragment cache, in at most one cache read and one database query.
+    """
+    from core.models import CacheVersion
+    if shared_cache():
+        version = get_cache().get(version_key(name))
+        if version is not None:
+            return version
+    version = CacheVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+    if shared_cache():
+        get_cache().add(version_key(name), version, None)
+    return version
+
+
+def bump_version(name):
+    """Make the cache ``name`` move to its next version, in every worker.
+    """
+    from core.models import CacheVersion
+    if not CacheVersion.objects.filter(name=name).update(version=F('version') + 1):
+        CacheVersion.objects.get_or_create(name=name, defaults={'version': 1})
+    if shared_cache():
+        version = CacheVersion.objects.get(name=name).version
+        transaction.on_commit(
+            lambda: get_cache().set(version_key(name), version, None))
+
+
+def cache_stats():
+    """Return the per-worker hit/miss counters of every fragment cache.
+    """
+    return {c.name: c.stats() for c in fragment_caches}
+
+
+class FragmentCache(object):
+    """
+    A cache of rendered fragments whose keys embed a version number. Bumping
+    the version (from a signal handler) makes every existing entry
+    unreachable, so entries only need a timeout when they can go stale
+    without any signal, as with searches for missing pages.
+
+    The version is stored in the database so that it is shared between
+    gunicorn workers even when each worker has its own local-memory cache.
+    With a shared cache backend the version is mirrored into the cache and
+    read from there. Either way the versions of all fragment caches are
+    looked up together, at most once per request.
+
+    Hit and miss counts are kept per worker process.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        fragment_caches.append(self)
+
+    def version(self, request=None):
+        versions = getattr(request, '_cache_versions', None)
+        if versions is None or self.name not in versions:
+            versions = load_versions()
+            if request is not None:
+                request._cache_versions = versions
+        return versions[self.name]
+
+    def bump(self):
+        bump_version(self.name)
+
+    def make_key(self, request, *parts):
+        return 'cms:{}:{}:{}'.format(
+            self.name, self.version(request), ':'.join(str(p) for p in parts))
+
+    def get(self, key):
+        value = get_cache().get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_many(self, keys):
+        values = get_cache().get_many(keys) if keys else {}
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def set(self, key, value, timeout=None):
+        get_cache().set(key, value, timeout)
+
+    def set_many(self, values, timeout=None):
+        if values:
+            get_cache().set_many(values, timeout)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.template import engines
+from functools import lru_cache
+import os
+import re
+from wagtail.core.models import Page
+
+from core.models import Content, ContentInclude, ContentListTag, ContentTag
+
+TEMPLATE_INCLUDE = re.compile(r"""{%\s*include_content\s+["']([^"']+)["']""")
+
+
+def published_state(page):
+    """Return the slug, title, menu flag and tags of ``page`` as last saved,
+    to compare with a new version being published.
+    """
+    state = Page.objects.filter(pk=page.pk).values('slug', 'title', 'show_in_menus').first()
+    if state is not None:
+        state['tags'] = set(ContentTag.objects.filter(
+            content_object_id=page.pk).values_list('tag__name', flat=True))
+    return state
+
+
+def affects_menus(page, previous=None):
+    """Whether a change to ``page`` can change the site menus.
+    """
+    return page.show_in_menus or previous is None or previous['show_in_menus']
+
+
+@lru_cache(maxsize=None)
+def template_snippets():
+    """
+    Return the slugs of the pages that the site's own templates include with
+    ``{% include_content "slug" %}``, such as the footers, which are part of
+    every page.
+    """
+    slugs = set()
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            # Installed packages' templates don't include our pages.
+            if not str(directory).startswith(settings.BASE_DIR):
+                continue
+            for parent, dirs, files in os.walk(str(directory)):
+                for name in files:
+                    if name.endswith('.html'):
+                        with open(os.path.join(parent, name), encoding='utf-8') as template:
+                            slugs.update(TEMPLATE_INCLUDE.findall(template.read()))
+    return frozenset(slugs)
+
+
+def shown_on_every_page(pks, previous=None):
+    """
+    Whether any of the pages ``pks`` (from affected_pages) is included by
+    the site's templates, or the page was until its slug changed from its
+    ``previous`` state, so that a change to it changes every page.
+    """
+    slugs = set(Content.objects.filter(pk__in=pks).values_list('slug', flat=True))
+    if previous is not None:
+        slugs.add(previous['slug'])
+    return not template_snippets().isdisjoint(slugs)
+
+
+def affected_pages(page, previous=None):
+    """
+    Return the ids of the Content pages whose rendered output can change when
+    ``page`` changes from its ``previous`` state (see published_state), using
+    the dependency index stored at publish time:
+
+    - the page itself;
+    - pages with a content_list of any of its old or new tags, or of every page;
+    - if its title or slug changed, its descendants, whose breadcrumbs show it;
+    - pages including any of those pages, directly or through other pages.
+
+    Changes to the site menus and to pages shown by the site's templates
+    aren't included, see affects_menus and shown_on_every_page.
+    """
+    slugs = {page.slug}
+    tags = {''} | set(page.tags.names())
+    if previous is not None:
+        slugs.add(previous['slug'])
+        tags |= previous['tags']
+    affected = {page.pk}
+    affected.update(ContentListTag.objects.filter(tag__in=tags).values_list('page_id', flat=True))
+    if previous is None or (previous['slug'], previous['title']) != (page.slug, page.title):
+        affected.update(Content.objects.filter(
+            path__startswith=page.path).values_list('pk', flat=True))
+
+    pending = slugs | set(Content.objects.filter(pk__in=affected).values_list('slug', flat=True))
+    seen = set()
+    while pending:
+        seen |= pending
+        including = ContentInclude.objects.filter(slug__in=pending).values_list('page_id', 'page__slug')
+        pending = set()
+        for pk, slug in including:
+            affected.add(pk)
+            if slug not in seen:
+                pending.add(slug)
+    return affected
+
+
+def affected_urls(page, previous=None):
+    """Return the URLs of the pages returned by affected_pages.
+    """
+    pages = Page.objects.filter(pk__in=affected_pages(page, previous))
+    return {url for url in (p.url for p in pages) if url}
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+import os
+import resource
+import threading
+import time
+
+from core.cache import cache_stats, get_cache
+
+STARTED = time.time()
+requests_served = 0
+
+_probe_lock = threading.Lock()
+_probe_executor = None
+_probe_pid = None
+_probe_result = (0, None)
+
+
+def count_request():
+    global requests_served
+    requests_served += 1
+
+
+def memory_usage():
+    """Return the worker's resident memory in bytes, falling back to its
+    peak where /proc isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def worker_stats():
+    return {
+        'pid': os.getpid(),
+        'uptime': round(time.time() - STARTED, 1),
+        'requests': requests_served,
+        'memory': memory_usage(),
+        'fragment_caches': cache_stats(),
+    }
+
+
+def probe_database():
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Exception:
+        # Reconnect on the next probe.
+        connection.close()
+        raise
+
+
+def probe_cache():
+    key = 'cms:healthcheck:{}'.format(os.getpid())
+    value = str(time.time())
+    cache = get_cache()
+    cache.set(key, value, 30)
+    if cache.get(key) != value:
+        raise ValueError('Cache read back a different value')
+
+
+PROBES = (('database', probe_database), ('cache', probe_cache))
+
+
+def run_probes():
+    """
+    Run the database and cache probes on a dedicated thread, giving each up
+    to ``HEALTHCHECK_TIMEOUT`` seconds, and return a dict of name -> status.
+    """
+    global _probe_executor, _probe_pid
+    if _probe_pid != os.getpid():
+        # Threads don't survive gunicorn forking its workers.
+        _probe_executor = ThreadPoolExecutor(max_workers=1)
+        _probe_pid = os.getpid()
+    timeout = getattr(settings, 'HEALTHCHECK_TIMEOUT', 2)
+    results = {}
+    for name, probe in PROBES:
+        started = time.time()
+        future = _probe_executor.submit(probe)
+        try:
+            future.result(timeout=timeout)
+        except TimeoutError:
+            results[name] = {'ok': False, 'error': 'Timed out after {}s'.format(timeout)}
+            # The stuck probe keeps the thread busy; later probes would only
+            # queue behind it.
+            _probe_pid = None
+            break
+        except Exception as e:
+            results[name] = {'ok': False, 'error': repr(e)}
+        else:
+            results[name] = {'ok': True, 'ms': round((time.time() - started) * 1000, 1)}
+    for name in dict(PROBES):
+        results.setdefault(name, {'ok': False, 'error': 'Not run'})
+    return results
+
+
+def readiness():
+    """Return the probe results, run at most once per worker every
+    ``HEALTHCHECK_CACHE_SECONDS`` seconds.
+    """
+    global _probe_result
+    with _probe_lock:
+        checked, result = _probe_result
+        if result is None or time.time() - checked > getattr(settings, 'HEALTHCHECK_CACHE_SECONDS', 10):
+            result = run_probes()
+            _probe_result = (time.time(), result)
+    return result
+
+
+def healthcheck(request):
+    """
+    Liveness: answer without any I/O. With ``?ready``, readiness: include the
+    database and cache probes, and return a 503 if any of them fails. With
+    ``?stats``, include the worker's request, memory and cache counters.
+    """
+    body = {'status': 'HEALTHY'}
+    if 'stats' in request.GET:
+        body['worker'] = worker_stats()
+    if 'ready' in request.GET:
+        body['checks'] = readiness()
+        if not all(check['ok'] for check in body['checks'].values()):
+            body['status'] = 'UNHEALTHY'
+            return JsonResponse(body, status=503)
+    return JsonResponse(body)
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils.html import escape
+import logging
+import re
+import threading
+from wagtail.images import get_image_model
+from wagtail.images.formats import get_image_format, get_image_formats
+from wagtail.images.models import Filter
+from wagtail.images.rich_text import ImageEmbedHandler
+
+from core.workers import run_in_background
+
+LOGGER = logging.getLogger('cms')
+EMBED_IMAGE = re.compile(r'<embed\b[^>]*\bembedtype="image"[^>]*>')
+EMBED_ID = re.compile(r'\bid="(\d+)"')
+_local = threading.local()
+
+
+def format_filter_specs():
+    """The filter specs of the registered rich text image formats.
+    """
+    return sorted({image_format.filter_spec for image_format in get_image_formats()})
+
+
+def generate_renditions(image):
+    """Create any missing renditions of ``image`` for the registered
+    formats. Returns the number of renditions checked.
+    """
+    specs = format_filter_specs()
+    for spec in specs:
+        image.get_rendition(spec)
+    return len(specs)
+
+
+def generate_renditions_for(pks):
+    """Create the format renditions for a chunk of images, logging (rather
+    than stopping at) any that fail.
+    """
+    done = 0
+    for image in get_image_model().objects.filter(pk__in=pks):
+        try:
+            generate_renditions(image)
+            done += 1
+        except Exception:
+            LOGGER.exception('Unable to generate renditions for image {}'.format(image.pk))
+    return done
+
+
+def generate_in_background(pk):
+    """Create the format renditions of a new image from a thread, so that
+    the upload doesn't wait for them, and pages using the image don't
+    resize it while being served.
+    """
+    if getattr(settings, 'RENDITIONS_ON_UPLOAD', True):
+        run_in_background(generate_renditions_for, [pk])
+
+
+def load_renditions(image_ids):
+    """
+    Return a dict of image id -> (image, {filter_spec: rendition}) for the
+    format renditions of ``image_ids``, in two queries.
+    """
+    Image = get_image_model()
+    images = Image.objects.in_bulk(image_ids)
+    loaded = {pk: (image, {}) for pk, image in images.items()}
+    if images:
+        Rendition = Image.get_rendition_model()
+        renditions = Rendition.objects.filter(image_id__in=images, filter_spec__in=format_filter_specs())
+        for rendition in renditions:
+            image, by_spec = loaded[rendition.image_id]
+            # Only the rendition matching the image's current focal point.
+            if rendition.focal_point_key == Filter(spec=rendition.filter_spec).get_cache_key(image):
+                rendition.image = image
+                by_spec[rendition.filter_spec] = rendition
+    return loaded
+
+
+@contextmanager
+def prefetched_renditions(sources):
+    """
+    Fetch the images embedded in the rich text ``sources`` and their format
+    renditions in bulk, for PrefetchedImageEmbedHandler to use while the
+    rich text is rendered.
+    """
+    image_ids = {
+        int(match.group(1))
+        for source in sources for tag in EMBED_IMAGE.findall(source)
+        for match in [EMBED_ID.search(tag)] if match}
+    previous = getattr(_local, 'renditions', None)
+    renditions = dict(previous or {})
+    # Keyed as in the embed tags' attributes.
+    renditions.update((str(pk), value) for pk, value in load_renditions(image_ids).items())
+    _local.renditions = renditions
+    try:
+        yield
+    finally:
+        _local.renditions = previous
+
+
+class PrefetchedImageEmbedHandler(ImageEmbedHandler):
+    """Renders rich text image embeds from renditions fetched by
+    prefetched_renditions, falling back to Wagtail's lookups (and resizing)
+    for anything not prefetched.
+    """
+    @classmethod
+    def expand_db_attributes(cls, attrs):
+        prefetched = (getattr(_local, 'renditions', None) or {}).get(attrs.get('id'))
+        if prefetched is None:
+            return super(PrefetchedImageEmbedHandler, cls).expand_db_attributes(attrs)
+        image, by_spec = prefetched
+        image_format = get_image_format(attrs['format'])
+        rendition = by_spec.get(image_format.filter_spec)
+        if rendition is None:
+            return image_format.image_to_html(image, attrs.get('alt', ''))
+        extra_attributes = {'alt': escape(attrs.get('alt', ''))}
+        if image_format.classnames:
+            extra_attributes['class'] = escape(image_format.classnames)
+        return rendition.img_tag(extra_attributes)
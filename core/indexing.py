@@ -0,0 +1,115 @@
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from wagtail.search.backends import get_search_backend
+from wagtail.search.index import get_indexed_models
+
+from core.workers import BackgroundWorker
+
+
+def queued_backends():
+    """The search backends configured with AUTO_UPDATE off, which are
+    updated from the queue instead of as objects are saved.
+    """
+    return [
+        get_search_backend(name) for name, params in getattr(settings, 'WAGTAILSEARCH_BACKENDS', {}).items()
+        if not params.get('AUTO_UPDATE', True)]
+
+
+def queue_index_update(sender, instance, **kwargs):
+    """
+    Queue ``instance`` to be added to, updated in or removed from the search
+    index, rather than updating it as the object is saved.
+    """
+    from core.models import SearchIndexUpdate
+    content_type = ContentType.objects.get_for_model(sender)
+    # A newer change to an object that is already queued just requeues it.
+    if not SearchIndexUpdate.objects.filter(
+            content_type=content_type, object_id=str(instance.pk)).update(queued=timezone.now()):
+        SearchIndexUpdate.objects.bulk_create([SearchIndexUpdate(
+            content_type=content_type, object_id=str(instance.pk))], ignore_conflicts=True)
+    if getattr(settings, 'SEARCH_INDEX_THREAD', True):
+        transaction.on_commit(index_updater.wake)
+
+
+def connect_signals():
+    if not queued_backends():
+        return
+    for model in get_indexed_models():
+        if getattr(model, 'search_auto_update', True):
+            post_save.connect(queue_index_update, sender=model)
+            post_delete.connect(queue_index_update, sender=model)
+
+
+def apply_index_updates(batch_size=500):
+    """
+    Apply a batch of queued index updates, a model at a time: queued objects
+    that are still indexed are added or updated in bulk, and the rest are
+    removed. Returns the number of updates applied.
+    """
+    from core.models import SearchIndexUpdate
+    with transaction.atomic():
+        updates = SearchIndexUpdate.objects.order_by('queued')
+        if connection.features.has_select_for_update_skip_locked:
+            updates = updates.select_for_update(skip_locked=True)
+        updates = list(updates[:batch_size])
+        by_type = {}
+        for update in updates:
+            by_type.setdefault(update.content_type_id, set()).add(update.object_id)
+
+        backends = queued_backends()
+        for content_type_id, object_ids in by_type.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            indexed = list(model.get_indexed_objects().filter(pk__in=object_ids))
+            if indexed:
+                for backend in backends:
+                    backend.add_bulk(model, indexed)
+            for object_id in object_ids - {str(obj.pk) for obj in indexed}:
+                removed = model(pk=model._meta.pk.to_python(object_id))
+                for backend in backends:
+                    backend.delete(removed)
+        SearchIndexUpdate.objects.filter(pk__in=[update.pk for update in updates]).delete()
+    return len(updates)
+
+
+def index_objects(index, model, pks):
+    """Add or update the indexed objects of ``model`` among ``pks`` in
+    ``index``, returning the number indexed.
+    """
+    objects = list(model.get_indexed_objects().filter(pk__in=pks))
+    if objects:
+        index.add_items(model, objects)
+    return len(objects)
+
+
+def index_chunk(backend_name, model_label, pks):
+    """Add or update a chunk of objects in one index of a search backend,
+    for the rebuild_search_index command's worker processes.
+    """
+    model = apps.get_model(model_label)
+    return index_objects(get_search_backend(backend_name).get_index_for_model(model), model, pks)
+
+
+def apply_all_index_updates(batch_size=500):
+    total = 0
+    while True:
+        count = apply_index_updates(batch_size)
+        total += count
+        if count < batch_size:
+            return total
+
+
+def apply_queued_index_updates():
+    apply_all_index_updates(getattr(settings, 'SEARCH_INDEX_BATCH_SIZE', 500))
+
+
+# Applies queued search index updates in each worker, shortly after they are
+# queued, and every SEARCH_INDEX_INTERVAL seconds for any left by other
+# processes. Updates that fail are left queued for the next run.
+index_updater = BackgroundWorker(
+    apply_queued_index_updates, 'SEARCH_INDEX_INTERVAL', 60, 'Unable to apply queued search index updates')
@@ -0,0 +1,201 @@
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from functools import wraps
+import cProfile
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+LOGGER = logging.getLogger('cms.timing')
+_local = threading.local()
+
+
+def enabled():
+    return getattr(settings, 'INSTRUMENTATION_ENABLED', False)
+
+
+class RequestTimings(object):
+    """Totals for the request being served by this thread, in seconds.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0
+        self.template_time = 0
+        self.template_depth = 0
+        self.sections = {}
+
+    def add(self, name, elapsed):
+        count, total = self.sections.get(name, (0, 0))
+        self.sections[name] = (count + 1, total + elapsed)
+
+    def summary(self, request, response):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'sql_count': self.sql_count,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+            'sections': {
+                name: {'count': count, 'ms': round(total * 1000, 1)}
+                for name, (count, total) in sorted(self.sections.items())},
+        }
+
+
+def current():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block to the current request's ``name``
+    section, if the request is being timed.
+    """
+    timings = current()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def timed(func):
+    """
+    Time calls to ``func`` (e.g. a template tag) as a section of the request
+    named after it. Returns ``func`` itself when instrumentation is disabled,
+    so that it costs nothing.
+    """
+    if not enabled():
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = current()
+        if timings is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.add(func.__name__, time.perf_counter() - started)
+    # Template tag arguments are parsed from the signature.
+    wrapper.__signature__ = inspect.signature(func)
+    return wrapper
+
+
+def sql_timer(execute, sql, params, many, context):
+    timings = current()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timings is not None:
+            timings.sql_count += 1
+            timings.sql_time += time.perf_counter() - started
+
+
+_template_render = Template.render
+
+
+def timed_template_render(self, context):
+    # Only the outermost template is counted, as includes render within it.
+    timings = current()
+    if timings is None or timings.template_depth:
+        return _template_render(self, context)
+    timings.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context)
+    finally:
+        timings.template_depth -= 1
+        timings.template_time += time.perf_counter() - started
+
+
+def server_timing(summary):
+    metrics = [
+        'total;dur={}'.format(summary['total_ms']),
+        'sql;dur={};desc="{} queries"'.format(summary['sql_ms'], summary['sql_count']),
+        'template;dur={}'.format(summary['template_ms']),
+    ]
+    for name, section in summary['sections'].items():
+        metrics.append('{};dur={};desc="{} calls"'.format(
+            re.sub(r'[^\w-]', '-', name), section['ms'], section['count']))
+    return ', '.join(metrics)
+
+
+def should_profile(request):
+    """Profile a sample of requests, or those from staff asking for it with
+    ``?profile``.
+    """
+    if 'profile' in request.GET:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+    return random.random() < getattr(settings, 'INSTRUMENTATION_PROFILE_RATE', 0)
+
+
+def save_profile(profile, request):
+    directory = getattr(settings, 'INSTRUMENTATION_PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}-{}.prof'.format(
+        time.strftime('%Y%m%d-%H%M%S'), os.getpid(), re.sub(r'[^\w-]+', '-', request.path).strip('-') or 'root')
+    profile.dump_stats(os.path.join(directory, name))
+    return name
+
+
+class InstrumentationMiddleware(object):
+    """
+    Times each request's SQL queries, template rendering and instrumented
+    sections (the core_tags template tags and search), returning them in a
+    Server-Timing header. Requests slower than ``INSTRUMENTATION_SLOW_MS``
+    are also logged as a JSON line to the cms.timing logger. A sample of
+    requests (``INSTRUMENTATION_PROFILE_RATE``), and those from staff with
+    ``?profile``, are profiled to ``INSTRUMENTATION_PROFILE_DIR``.
+
+    Removed from the middleware stack unless ``INSTRUMENTATION_ENABLED``.
+    """
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow = getattr(settings, 'INSTRUMENTATION_SLOW_MS', 500)
+        Template.render = timed_template_render
+
+    def __call__(self, request):
+        _local.timings = timings = RequestTimings()
+        profile = cProfile.Profile() if should_profile(request) else None
+        try:
+            with self.sql_timers():
+                if profile is None:
+                    response = self.get_response(request)
+                else:
+                    response = profile.runcall(self.get_response, request)
+        finally:
+            _local.timings = None
+
+        summary = timings.summary(request, response)
+        if profile is not None:
+            summary['profile'] = save_profile(profile, request)
+        response['Server-Timing'] = server_timing(summary)
+        if summary['total_ms'] >= self.slow or profile is not None:
+            LOGGER.info(json.dumps(summary))
+        return response
+
+    def sql_timers(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(sql_timer))
+        return stack
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment
+import json
+import platform
+import subprocess
+import sys
+
+from core.benchmark import build_tree, run_benchmarks
+from core.models import Content
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds a synthetic page tree in a separate test database and times the public '
+        'rendering paths against it, writing the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000, help='Number of Content pages to generate')
+        parser.add_argument('--depth', type=int, default=4, help='Levels of pages below the home page')
+        parser.add_argument('--fanout', type=int, default=10, help='Children per page')
+        parser.add_argument('--runs', type=int, default=50, help='Timed requests per endpoint')
+        parser.add_argument('--samples', type=int, default=20, help='URLs sampled per endpoint')
+        parser.add_argument('--processes', type=int, default=1, help='Processes used to render excerpts and index pages')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database, and reuse its page tree if it has as many pages')
+        parser.add_argument('--output', help='File to write the JSON results to (default: stdout)')
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Benchmarks must run against PostgreSQL, to use the postgres_search backend')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            # A private local-memory cache, so that results don't depend on
+            # (or disturb) a shared cache.
+            with override_settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+                    ALLOWED_HOSTS=['testserver'], NOTFOUND_SEARCH_RATE_LIMIT=10 ** 9):
+                results = self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def benchmark(self, options):
+        existing = Content.objects.exclude(url_path__startswith='/home/snippets').count()
+        if existing and existing != options['pages']:
+            raise CommandError('The kept test database has {} pages, not {}'.format(existing, options['pages']))
+        if not existing:
+            self.log('Building a tree of {pages} pages, {depth} deep with a fanout of {fanout}'.format(**options))
+            build_tree(options['pages'], options['depth'], options['fanout'], log=self.log)
+            self.log('Rendering excerpts')
+            call_command('update_excerpts', processes=options['processes'], stdout=self.stderr)
+            # The search index is updated from a queue, not as pages are saved.
+            self.log('Indexing pages')
+            call_command('rebuild_search_index', processes=options['processes'], stdout=self.stderr)
+
+        try:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'database': connection.vendor,
+            'page_cache': getattr(settings, 'PAGE_CACHE_ENABLED', False),
+            'pages': Content.objects.count(),
+            'depth': options['depth'],
+            'fanout': options['fanout'],
+            'results': run_benchmarks(options['runs'], options['samples'], log=self.log),
+        }
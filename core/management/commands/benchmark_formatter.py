@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from collections import Counter
+import copy
+import timeit
+
+from oim_cms.utils import FieldsFormatter
+
+
+def legacy_format_data(request, lookup, data, formatter):
+    """The original recursive lookup of FieldsFormatter.format_data, splitting
+    the lookup for every row and field, for comparison.
+    """
+    parts = lookup.split('.')
+    part, remaining_lookup = parts[0], '.'.join(parts[1:])
+    try:
+        if hasattr(data, 'keys') and hasattr(data, '__getitem__'):
+            if remaining_lookup:
+                legacy_format_data(request, remaining_lookup, data[part], formatter)
+            else:
+                data[part] = formatter(request, data[part])
+        elif remaining_lookup:
+            legacy_format_data(request, remaining_lookup, getattr(data, part), formatter)
+        else:
+            setattr(data, part, formatter(request, getattr(data, part)))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        # Missing keys and attributes, and values the formatter can't handle.
+        pass
+    return data
+
+
+def upper(request, value):
+    return value.upper()
+
+
+class Command(BaseCommand):
+    help = 'Times FieldsFormatter against the original per-row lookup on a generated payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows in the payload')
+        parser.add_argument('--repeat', type=int, default=5, help='Timing runs, the best is reported')
+
+    def handle(self, *args, **options):
+        formatters = {'name': upper, 'owner.email': upper, 'location.site.name': upper, 'missing': upper}
+        rows = [{
+            'name': 'row {}'.format(i),
+            'owner': {'email': 'user{}@example.com'.format(i)},
+            'location': {'site': {'name': 'site {}'.format(i % 50)}},
+        } for i in range(options['rows'])]
+
+        def legacy():
+            payload = copy.deepcopy(rows)
+            for row in payload:
+                for lookup, formatter in formatters.items():
+                    legacy_format_data(None, lookup, row, formatter)
+            return payload
+
+        failures = Counter()
+        formatter = FieldsFormatter(formatters, failures=failures)
+
+        def compiled():
+            return formatter.format(None, copy.deepcopy(rows))
+
+        assert legacy() == compiled()
+        baseline = min(timeit.repeat(lambda: copy.deepcopy(rows), number=1, repeat=options['repeat']))
+        old = min(timeit.repeat(legacy, number=1, repeat=options['repeat'])) - baseline
+        new = min(timeit.repeat(compiled, number=1, repeat=options['repeat'])) - baseline
+        self.stdout.write('{} rows x {} fields: original {:.1f} ms, compiled {:.1f} ms ({:.1f}x)'.format(
+            options['rows'], len(formatters), old * 1000, new * 1000, old / new))
+        failures.clear()
+        compiled()
+        self.stdout.write('Failures counted per run: {}'.format(dict(failures)))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from wagtail.images import get_image_model
+
+from core.images import format_filter_specs, generate_renditions_for
+from core.workers import run_chunks
+
+
+class Command(BaseCommand):
+    help = 'Creates any missing renditions of every image for the registered rich text image formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Number of worker processes to resize images with')
+        parser.add_argument(
+            '--chunk-size', type=int, default=20,
+            help='Number of images given to a worker at a time')
+
+    def handle(self, *args, **options):
+        pks = list(get_image_model().objects.order_by('pk').values_list('pk', flat=True))
+        done = run_chunks(generate_renditions_for, pks, options['processes'], options['chunk_size'])
+        self.stdout.write('Checked {} renditions ({}) for {} of {} images'.format(
+            done * len(format_filter_specs()), ', '.join(format_filter_specs()), done, len(pks)))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Content
+from core.prerender import prerender_page, remove_all
+from core.workers import run_chunks
+
+
+def prerender_pages(pks):
+    """Pre-render a chunk of Content pages, returning the number written.
+    """
+    return sum(prerender_page(page) for page in Content.objects.filter(pk__in=pks))
+
+
+class Command(BaseCommand):
+    help = 'Renders live Content pages to static HTML files under PRERENDER_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Remove all pre-rendered pages before rendering')
+        parser.add_argument(
+            '--pages',
+            help='Comma-separated ids of the pages to render, instead of every live page')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Number of worker processes to render pages with')
+        parser.add_argument(
+            '--chunk-size', type=int, default=50,
+            help='Number of pages given to a worker at a time')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            remove_all()
+        pages = Content.objects.all()
+        if options['pages']:
+            pages = pages.filter(pk__in=options['pages'].split(','))
+        else:
+            pages = pages.live()
+        pks = list(pages.order_by('path').values_list('pk', flat=True))
+        done = run_chunks(prerender_pages, pks, options['processes'], options['chunk_size'])
+        self.stdout.write('Pre-rendered {} of {} pages'.format(done, len(pks)))
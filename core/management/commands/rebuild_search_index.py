@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from functools import partial
+import time
+from wagtail.search.backends import get_search_backend
+from wagtail.search.index import get_indexed_models
+from wagtail.search.management.commands.update_index import group_models_by_index
+
+from core.indexing import apply_all_index_updates, index_chunk, index_objects
+from core.workers import run_chunks
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search index, indexing chunks of objects in parallel, or applies the queued index updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', action='append', dest='backends',
+            help='Search backend to rebuild (all configured backends by default)')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Number of worker processes to index objects with')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of objects given to a worker at a time')
+        parser.add_argument(
+            '--pending', action='store_true',
+            help='Only apply the queued index updates')
+
+    def handle(self, *args, **options):
+        if not options['pending']:
+            names = options['backends'] or list(getattr(settings, 'WAGTAILSEARCH_BACKENDS', {'default': {}}))
+            for name in names:
+                self.rebuild(name, options['processes'], options['chunk_size'])
+        # Anything queued during the rebuild.
+        applied = apply_all_index_updates(getattr(settings, 'SEARCH_INDEX_BATCH_SIZE', 500))
+        self.stdout.write('Applied {} queued index updates'.format(applied))
+
+    def rebuild(self, name, processes, chunk_size):
+        backend = get_search_backend(name)
+        if not backend.rebuilder_class:
+            self.stdout.write("{}: backend doesn't require rebuilding".format(name))
+            return
+        # An atomic rebuild happens within the parent's transaction.
+        if getattr(backend, 'atomic_rebuilder_class', None) is backend.rebuilder_class:
+            processes = 1
+
+        for index, models in group_models_by_index(backend, get_indexed_models()).items():
+            started = time.perf_counter()
+            rebuilder = backend.rebuilder_class(index)
+            index = rebuilder.start()
+            done = 0
+            for model in models:
+                index.add_model(model)
+                pks = list(model.get_indexed_objects().order_by('pk').values_list('pk', flat=True))
+                if processes > 1:
+                    add = partial(index_chunk, name, model._meta.label)
+                else:
+                    # The index returned by start(), in case it isn't the live one.
+                    add = partial(index_objects, index, model)
+                done += run_chunks(add, pks, processes, chunk_size)
+            rebuilder.finish()
+
+            elapsed = time.perf_counter() - started
+            self.stdout.write('{}: indexed {} objects of {} models in {:.1f}s ({:.0f} objects/s)'.format(
+                name, done, len(models), elapsed, done / elapsed if elapsed else 0))
@@ -0,0 +1,28 @@
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+import time
+
+from core.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Sends the emails waiting in the outbox, e.g. those left by a restarted worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Number of emails sent per transaction')
+        parser.add_argument(
+            '--loop', type=int, default=0, metavar='SECONDS',
+            help='Keep running, checking the outbox at this interval')
+
+    def handle(self, *args, **options):
+        # One SMTP connection is reused while there are emails to send.
+        mail_connection = get_connection()
+        while True:
+            sent = send_pending(mail_connection, options['batch_size'])
+            if sent or not options['loop']:
+                self.stdout.write('Processed {} queued emails'.format(sent))
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
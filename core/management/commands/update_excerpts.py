@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Content
+from core.workers import run_chunks
+
+
+def update_excerpts(pks):
+    """Regenerate the stored excerpts for a chunk of Content pages.
+    """
+    for page in Content.objects.filter(pk__in=pks):
+        page.update_excerpt()
+    return len(pks)
+
+
+class Command(BaseCommand):
+    help = 'Regenerates the stored excerpt and plain text of Content pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Only update pages without a stored excerpt (backfill)')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Number of worker processes to render excerpts with')
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help='Number of pages given to a worker at a time')
+
+    def handle(self, *args, **options):
+        pages = Content.objects.order_by('path')
+        if options['missing']:
+            pages = pages.filter(excerpt='')
+        pks = list(pages.values_list('pk', flat=True))
+        done = run_chunks(update_excerpts, pks, options['processes'], options['chunk_size'])
+        self.stdout.write('Updated excerpts for {} pages'.format(done))
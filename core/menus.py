@@ -0,0 +1,112 @@
+from wagtail.core.models import Page
+
+from core.cache import FragmentCache
+
+
+menu_cache = FragmentCache('menu')
+
+
+class MenuTree(object):
+    """The live, in-menu pages below a root page, loaded with a single
+    treebeard path-prefix query and indexed by parent path so that every
+    menu tag can be served from memory.
+    """
+    def __init__(self, root):
+        self.root = root
+        self._children = {}
+        pages = Page.objects.live().in_menu().filter(
+            path__startswith=root.path, depth__gt=root.depth).order_by('path')
+        for page in pages:
+            self._children.setdefault(page.path[:-Page.steplen], []).append(page)
+        for menuitems in self._children.values():
+            for menuitem in menuitems:
+                menuitem.show_dropdown = menuitem.path in self._children
+
+    def contains(self, page):
+        return page.path.startswith(self.root.path)
+
+    def children(self, parent):
+        return self._children.get(parent.path, [])
+
+
+def get_menu_tree(request, page):
+    """Return a MenuTree covering ``page``, reusing any tree already loaded
+    during this request.
+    """
+    trees = getattr(request, '_menu_trees', None)
+    if trees is None:
+        trees = []
+        if request is not None:
+            request._menu_trees = trees
+    for tree in trees:
+        if tree.contains(page):
+            return tree
+    tree = MenuTree(page)
+    trees.append(tree)
+    return tree
+
+
+def menu_children(request, parent):
+    """Return the live, in-menu children of ``parent``, each flagged with
+    ``show_dropdown``.
+    """
+    return get_menu_tree(request, parent).children(parent)
+
+
+def render_menu(context, template_name, parent, calling_page=None):
+    """
+    Render a top menu template for the children of ``parent``, caching the
+    HTML per site, menu root and active top-level section. Search requests
+    are not cached as the menu search box echoes the query.
+    """
+    request = context['request']
+    # We don't directly check if calling_page is None since the template
+    # engine can pass an empty string to calling_page
+    # if the variable passed as calling_page does not exist.
+    active_path = None
+    if calling_page and calling_page.path.startswith(parent.path):
+        active_path = calling_page.path[:len(parent.path) + Page.steplen]
+
+    cacheable = 'q' not in request.GET
+    if cacheable:
+        site = getattr(request, 'site', None)
+        key = menu_cache.make_key(
+            request, getattr(site, 'pk', None), template_name, parent.pk, active_path)
+        html = menu_cache.get(key)
+        if html is not None:
+            return html
+
+    menuitems = menu_children(request, parent)
+    for menuitem in menuitems:
+        menuitem.active = menuitem.path == active_path
+    template = context.template.engine.get_template(template_name)
+    html = template.render(context.new({
+        'calling_page': calling_page,
+        'menuitems': menuitems,
+        # required by the pageurl tag that we want to use within this template
+        'request': request,
+    }))
+    if cacheable:
+        menu_cache.set(key, html)
+    return html
+
+
+def page_ancestors(request, page):
+    """
+    Return the ancestors of ``page`` below the tree root, followed by the page
+    itself. Ancestor paths are prefixes of the page's treebeard path, so they
+    are fetched in one query, and the result is memoised for the request.
+    """
+    # The template engine passes an empty string for a missing variable.
+    if not page:
+        return []
+    memo = getattr(request, '_page_ancestors', None)
+    if memo is None:
+        memo = {}
+        if request is not None:
+            request._page_ancestors = memo
+    if page.pk not in memo:
+        paths = [page.path[:depth * Page.steplen] for depth in range(2, page.depth)]
+        ancestors = list(Page.objects.filter(path__in=paths).order_by('path')) if paths else []
+        memo[page.pk] = ancestors + [page]
+    return list(memo[page.pk])
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.17 on 2026-10-18 18:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_include_graph(apps, schema_editor):
+    Content = apps.get_model('core', 'Content')
+    ContentInclude = apps.get_model('core', 'ContentInclude')
+    ContentInclude.objects.bulk_create(
+        ContentInclude(page=page, slug=slug)
+        for page in Content.objects.all()
+        for slug in {block.value for block in page.body or [] if block.block_type == 'include_content'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentInclude',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=255)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='includes', to='core.Content')),
+            ],
+        ),
+        migrations.RunPython(build_include_graph, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.17 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_contentinclude'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='content',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.17 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_content_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='content',
+            name='excerpt_text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
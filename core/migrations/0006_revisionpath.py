@@ -0,0 +1,45 @@
+# Generated by Django 2.2.17 on 2026-10-18 18:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+
+def build_revision_paths(apps, schema_editor):
+    PageRevision = apps.get_model('wagtailcore', 'PageRevision')
+    RevisionPath = apps.get_model('core', 'RevisionPath')
+    batch = []
+    for revision in PageRevision.objects.only('pk', 'page_id', 'content_json', 'created_at').iterator():
+        content = json.loads(revision.content_json)
+        batch.append(RevisionPath(
+            revision_id=revision.pk, page_id=revision.page_id,
+            url_path=(content.get('url_path') or '').lower(), created_at=revision.created_at))
+        if len(batch) >= 1000:
+            RevisionPath.objects.bulk_create(batch)
+            batch = []
+    RevisionPath.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0059_apply_collection_ordering'),
+        ('core', '0005_content_excerpt_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevisionPath',
+            fields=[
+                ('revision', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='wagtailcore.PageRevision')),
+                ('url_path', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.Page')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='revisionpath',
+            index=models.Index(fields=['url_path', '-created_at'], name='core_revisi_url_pat_357c7b_idx'),
+        ),
+        migrations.RunPython(build_revision_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.17 on 2026-10-18 18:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+
+def build_list_tags(apps, schema_editor):
+    Content = apps.get_model('core', 'Content')
+    ContentListTag = apps.get_model('core', 'ContentListTag')
+    rows = []
+    for page in Content.objects.all():
+        tags = set()
+        for block in page.body or []:
+            if block.block_type == 'content_list':
+                try:
+                    listed = json.loads(block.value)['tags'].split(',')
+                except Exception:
+                    continue
+                tags.update(listed if listed[0] else [''])
+        rows.extend(ContentListTag(page=page, tag=tag) for tag in tags)
+    ContentListTag.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_revisionpath'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='content',
+            name='cache_generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ContentListTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listed_tags', to='core.Content')),
+            ],
+        ),
+        migrations.RunPython(build_list_tags, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,23 @@
-from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.http import HttpResponseRedirect
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.html import strip_tags
+import json
 from modelcluster.fields import ParentalKey
 from modelcluster.contrib.taggit import ClusterTaggableManager
-import os
 from taggit.models import TaggedItemBase
 from wagtail.admin.edit_handlers import FieldPanel, StreamFieldPanel
 from wagtail.core import blocks
-from wagtail.core.models import Page
+from wagtail.core.models import Page, PageRevision
 from wagtail.core.fields import StreamField
 from wagtail.images.formats import Format, register_image_format
 from wagtail.search import index
 
+from core.pagecache import CSRF_PLACEHOLDER, cacheable, serve_cached
+
 
 '''To add a new size format use the following format
    register_image_format(Format('name', 'label', 'class_names', 'filter_spec'))
@@ -30,6 +35,14 @@ register_image_format(Format('logo_icon', 'Logo_Icon', 'richtext-image logo_icon
 register_image_format(Format('original', 'Original', 'richtext-image original', 'original'))
 
 
+class CacheVersion(models.Model):
+    """A version number for a family of cached fragments, shared by every
+    worker process. See core.cache.FragmentCache.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+
+
 class ContentTag(TaggedItemBase):
     content_object = ParentalKey('core.Content', related_name='tagged_items')
 
@@ -49,6 +62,12 @@ class Content(Page):
         ('f6-vue.html', 'f6-vue.html'),
     ), default='f6-content.html')
     tags = ClusterTaggableManager(through=ContentTag, blank=True)
+    # The rendered body shown by content_list and its plain text, updated when
+    # the page is published or by the update_excerpts management command.
+    excerpt = models.TextField(blank=True, editable=False)
+    excerpt_text = models.TextField(blank=True, editable=False)
+    # Incremented to purge cached responses for this page, see core.pagecache.
+    cache_generation = models.PositiveIntegerField(default=0, editable=False)
 
     def get_template(self, request, *args, **kwargs):
         template_name = request.GET.get('template', self.template_filename)
@@ -72,14 +91,157 @@ class Content(Page):
         index.FilterField('url_path'),
     ]
 
+    def render_excerpt(self):
+        """Render the body of this page without nested include_content or
+        content_list blocks.
+        """
+        return render_to_string('core/tags/include_content.html', {'self': self, 'embed': True})
+
+    def update_excerpt(self):
+        """Store the excerpt of this page without saving (or re-publishing)
+        the rest of it.
+        """
+        self.excerpt = self.render_excerpt()
+        self.excerpt_text = ' '.join(strip_tags(self.excerpt).split())
+        Content.objects.filter(pk=self.pk).update(
+            excerpt=self.excerpt, excerpt_text=self.excerpt_text)
+
+    def include_slugs(self):
+        """Return the slugs of the pages included by the body of this page.
+        """
+        return {block.value for block in self.body or [] if block.block_type == 'include_content'}
+
+    def list_tags(self):
+        """Return the tags listed by the content_list blocks in the body of
+        this page, with '' standing for a list of every page.
+        """
+        from core.templatetags.core_tags import parse_content_list
+        tags = set()
+        for block in self.body or []:
+            if block.block_type == 'content_list':
+                try:
+                    listed = parse_content_list(block.value)[0]
+                except Exception:
+                    continue
+                tags.update(listed if listed[0] else [''])
+        return tags
+
+    def update_dependencies(self):
+        """Store the pages this page includes and the tags it lists in the
+        dependency index (see core.dependencies).
+        """
+        ContentInclude.objects.filter(page=self).delete()
+        ContentInclude.objects.bulk_create(
+            ContentInclude(page=self, slug=slug) for slug in self.include_slugs())
+        ContentListTag.objects.filter(page=self).delete()
+        ContentListTag.objects.bulk_create(
+            ContentListTag(page=self, tag=tag) for tag in self.list_tags())
+
+    def clean(self):
+        super(Content, self).clean()
+        from core.snippets import find_include_cycle
+        cycle = find_include_cycle(self.slug, self.include_slugs())
+        if cycle:
+            raise ValidationError({'body': 'Included content loops back to this page: {}'.format(
+                ' > '.join(cycle))})
+
+    def with_content_json(self, content_json):
+        obj = super(Content, self).with_content_json(content_json)
+        # These are maintained outside of revisions, so keep the current values.
+        obj.excerpt = self.excerpt
+        obj.excerpt_text = self.excerpt_text
+        obj.cache_generation = self.cache_generation
+        return obj
+
+    def get_context(self, request, *args, **kwargs):
+        context = super(Content, self).get_context(request, *args, **kwargs)
+        if getattr(request, 'page_cache_render', False):
+            # Page cache entries are shared between visitors, see core.pagecache.
+            context['csrf_token'] = CSRF_PLACEHOLDER
+        elif getattr(request, 'prerender', False):
+            # Static pages have no visitor to make a token for, see core.prerender.
+            context['csrf_token'] = 'NOTPROVIDED'
+        return context
+
     def serve(self, request):
         if 'draft' in request.GET:
             return HttpResponseRedirect('/admin/pages/{}/view_draft/'.format(self.pk))
-        response = super(Content, self).serve(request)
-        if 'embed' in request.GET:
-            with open(os.path.join(settings.MEDIA_ROOT, 'images', self.slug + '.html')) as output:
-                output.write(response.content)
-        return response
+        if cacheable(request):
+            return serve_cached(self, request, super(Content, self).serve)
+        return super(Content, self).serve(request)
 
     class Meta:
         ordering = ('date',)
+
+
+class ContentInclude(models.Model):
+    """An edge in the include graph: the body of ``page`` has an
+    include_content block for ``slug``. Updated when the page is published.
+    """
+    page = models.ForeignKey(Content, on_delete=models.CASCADE, related_name='includes')
+    slug = models.SlugField(max_length=255)
+
+
+class ContentListTag(models.Model):
+    """A tag listed by a content_list block in the body of ``page``, or ''
+    for a list of every page. Updated when the page is published.
+    """
+    page = models.ForeignKey(Content, on_delete=models.CASCADE, related_name='listed_tags')
+    tag = models.CharField(max_length=100, blank=True, db_index=True)
+
+
+class RevisionPath(models.Model):
+    """The url_path of a page revision, lowercased, so that drafts can be
+    looked up by URL (in any case) without searching every revision's JSON.
+    Added when a revision is saved.
+    """
+    revision = models.OneToOneField(
+        PageRevision, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    page = models.ForeignKey(Page, on_delete=models.CASCADE, related_name='+')
+    url_path = models.TextField()
+    created_at = models.DateTimeField()
+
+    @classmethod
+    def for_revision(cls, revision):
+        content = revision.content_json
+        if isinstance(content, str):
+            content = json.loads(content)
+        return cls(
+            revision=revision, page_id=revision.page_id, url_path=(content.get('url_path') or '').lower(),
+            created_at=revision.created_at)
+
+    class Meta:
+        indexes = [models.Index(fields=['url_path', '-created_at'])]
+
+
+class OutboxEmail(models.Model):
+    """An email waiting to be sent, or given up on, by core.outbox.
+    """
+    subject = models.TextField()
+    body = models.TextField()
+    html = models.BooleanField(default=False)
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField(help_text='One address per line')
+    created = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['sent', 'next_attempt'])]
+
+    def __str__(self):
+        return self.subject
+
+
+class SearchIndexUpdate(models.Model):
+    """An object waiting to be updated in the search index, see
+    core.indexing.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='+')
+    object_id = models.CharField(max_length=255)
+    queued = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = [('content_type', 'object_id')]
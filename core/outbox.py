@@ -0,0 +1,94 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+import logging
+
+from core.workers import BackgroundWorker
+
+LOGGER = logging.getLogger('cms')
+
+
+def queue_email(subject, body, from_email, recipients, html=False):
+    """
+    Save an email to the outbox, to be sent after the current transaction
+    commits by this worker's delivery thread (or the send_outbox command).
+    """
+    from core.models import OutboxEmail
+    email = OutboxEmail.objects.create(
+        subject=subject, body=body, html=html, from_email=from_email,
+        recipients='\n'.join(recipients))
+    if getattr(settings, 'EMAIL_OUTBOX_THREAD', True):
+        transaction.on_commit(outbox.wake)
+    return email
+
+
+def pending_emails(limit):
+    """The emails due to be sent, locked against other senders where the
+    database supports it.
+    """
+    from core.models import OutboxEmail
+    emails = OutboxEmail.objects.filter(
+        sent__isnull=True, next_attempt__lte=timezone.now(),
+        attempts__lt=getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 8),
+    ).order_by('next_attempt')
+    if connection.features.has_select_for_update_skip_locked:
+        emails = emails.select_for_update(skip_locked=True)
+    return emails[:limit]
+
+
+def message(email):
+    recipients = email.recipients.splitlines()
+    msg = EmailMultiAlternatives(email.subject, email.body, email.from_email, recipients)
+    if email.html:
+        msg.attach_alternative(email.body, 'text/html')
+    return msg
+
+
+def send_batch(mail_connection, batch_size=50):
+    """
+    Send a batch of due emails over an open ``mail_connection``. Emails that
+    fail are retried after ``EMAIL_OUTBOX_RETRY_DELAY`` seconds, doubling
+    with each attempt. Returns the number of emails processed.
+    """
+    delay = getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', 60)
+    with transaction.atomic():
+        emails = list(pending_emails(batch_size))
+        for email in emails:
+            try:
+                mail_connection.send_messages([message(email)])
+            except Exception as e:
+                email.attempts += 1
+                email.next_attempt = timezone.now() + timedelta(seconds=delay * 2 ** (email.attempts - 1))
+                email.last_error = repr(e)
+                LOGGER.warning('Unable to send email {} (attempt {}): {!r}'.format(email.pk, email.attempts, e))
+                # Drop a connection that may be broken; the next send reopens it.
+                mail_connection.close()
+            else:
+                email.attempts += 1
+                email.sent = timezone.now()
+            email.save(update_fields=['attempts', 'next_attempt', 'last_error', 'sent'])
+    return len(emails)
+
+
+def send_pending(mail_connection=None, batch_size=50):
+    """Send every due email in batches over one SMTP connection, returning
+    the number processed.
+    """
+    mail_connection = mail_connection or get_connection()
+    total = 0
+    try:
+        while True:
+            count = send_batch(mail_connection, batch_size)
+            total += count
+            if count < batch_size:
+                return total
+    finally:
+        mail_connection.close()
+
+
+# Sends queued emails in each worker, so that the request saving them doesn't
+# wait on the SMTP relay: when an email is queued, and every
+# EMAIL_OUTBOX_INTERVAL seconds for retries.
+outbox = BackgroundWorker(send_pending, 'EMAIL_OUTBOX_INTERVAL', 60, 'Unable to send queued emails')
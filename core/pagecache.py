@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+import hashlib
+import time
+
+from core.cache import FragmentCache, hash_key
+
+
+page_cache = FragmentCache('page')
+
+# Query parameters that Content pages render differently for; any other
+# parameter makes a request uncacheable.
+CACHE_QUERY_PARAMS = ('fullscreen', 'template')
+# Rendered in place of the CSRF token in cached pages, and replaced by a
+# token for the current visitor when the page is served.
+CSRF_PLACEHOLDER = 'CACHED-PAGE-CSRF-TOKEN'
+
+
+def cacheable(request):
+    """Whether a request for a Content page may be served from the cache.
+    """
+    if not getattr(settings, 'PAGE_CACHE_ENABLED', False) or request.method not in ('GET', 'HEAD'):
+        return False
+    if getattr(request, 'is_preview', False) or getattr(request, 'prerender', False):
+        return False
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return False
+    return all(param in CACHE_QUERY_PARAMS for param in request.GET)
+
+
+def page_cache_key(request, page):
+    # The path and template come from the client, so are hashed to make a
+    # valid cache key.
+    site = getattr(request, 'site', None)
+    return page_cache.make_key(
+        request, getattr(site, 'pk', None), page.pk, page.cache_generation, hash_key(request.path),
+        'fullscreen' in request.GET, hash_key(request.GET.get('template', '')))
+
+
+def insert_csrf_token(request, response):
+    """Replace the CSRF placeholder in ``response`` with a token for the
+    current visitor, which also sets their CSRF cookie.
+    """
+    response.content = response.content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+
+
+def serve_cached(page, request, serve):
+    """
+    Return the response to ``request`` for ``page`` from the page cache,
+    calling ``serve`` to render and cache it on a miss. Cached responses carry
+    ETag and Last-Modified headers, and conditional requests that match them
+    get a 304 without the page being rendered.
+    """
+    key = page_cache_key(request, page)
+    entry = page_cache.get(key)
+    response = None
+    if entry is None:
+        request.page_cache_render = True
+        response = serve(request)
+        if hasattr(response, 'render'):
+            response.render()
+        if response.status_code != 200:
+            insert_csrf_token(request, response)
+            return response
+        content = response.content
+        entry = {
+            'content': content,
+            'content_type': response['Content-Type'],
+            'etag': quote_etag(hashlib.md5(content).hexdigest()),
+            'last_modified': int(time.time()),
+        }
+        page_cache.set(key, entry)
+
+    conditional = get_conditional_response(
+        request, etag=entry['etag'], last_modified=entry['last_modified'])
+    if conditional is not None:
+        response = conditional
+    else:
+        if response is None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        insert_csrf_token(request, response)
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    return response
@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.wsgi import WSGIRequest
+import gzip
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOGGER = logging.getLogger('cms')
+# Pages with forms need a CSRF token for each visitor, so can't be static.
+POST_FORM = re.compile(rb'<form[^>]+method=["\']?post', re.IGNORECASE)
+
+
+def prerender_root():
+    return getattr(settings, 'PRERENDER_ROOT', os.path.join(settings.BASE_DIR, 'prerendered'))
+
+
+def page_directory(page):
+    """
+    Return the directory holding the static files for ``page``, laid out as
+    ``PRERENDER_ROOT/<hostname>/<path>/`` so that a web server can serve
+    ``index.html`` (or its ``.gz`` and ``.br`` siblings) for the page's URL,
+    e.g. nginx with ``try_files /prerendered/$host$uri/index.html @app``.
+    Returns None if the page isn't routable.
+    """
+    url_parts = page.get_url_parts()
+    if url_parts is None:
+        return None
+    site_id, root_url, page_path = url_parts
+    hostname = root_url.split('://')[-1].split(':')[0]
+    return os.path.join(prerender_root(), hostname, page_path.strip('/'))
+
+
+def write_atomic(path, content):
+    """Write ``content`` to ``path`` through a temporary file in the same
+    directory, so readers never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def render_page(page):
+    """
+    Render ``page`` as served to an anonymous visitor. Returns the content, or
+    None if the page can't be served as a static file: it isn't live or
+    routable, has view restrictions, doesn't render successfully or contains
+    a POST form.
+    """
+    if not page.live or page.get_view_restrictions().exists():
+        return None
+    request = WSGIRequest(page._get_dummy_headers())
+    request.user = AnonymousUser()
+    request.prerender = True
+    request.site = page.get_site()
+    response = page.serve(request)
+    if hasattr(response, 'render'):
+        response.render()
+    if response.status_code != 200 or POST_FORM.search(response.content):
+        return None
+    return response.content
+
+
+def prerender_page(page):
+    """
+    Write ``page`` to its static ``index.html``, with precompressed siblings,
+    or remove any static files for it if it can't be pre-rendered. Returns
+    True if the page was written.
+    """
+    directory = page_directory(page)
+    if directory is None:
+        return False
+    content = render_page(page)
+    if content is None:
+        remove_page(page)
+        return False
+    path = os.path.join(directory, 'index.html')
+    if brotli is not None:
+        write_atomic(path + '.br', brotli.compress(content))
+    elif os.path.exists(path + '.br'):
+        os.unlink(path + '.br')
+    write_atomic(path + '.gz', gzip.compress(content, 9))
+    write_atomic(path, content)
+    return True
+
+
+def remove_page(page):
+    """Remove the static files for ``page``, if any.
+    """
+    directory = page_directory(page)
+    for suffix in ('', '.gz', '.br'):
+        path = os.path.join(directory or '', 'index.html' + suffix)
+        if directory and os.path.exists(path):
+            os.unlink(path)
+
+
+def remove_all():
+    """Remove every pre-rendered page. The web server falls back to the
+    application.
+    """
+    root = prerender_root()
+    if os.path.isdir(root):
+        stale = '{}.stale-{}'.format(root, time.time())
+        os.rename(root, stale)
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def run_prerender_pages(args):
+    command = [
+        sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'prerender_pages',
+        '--processes', str(getattr(settings, 'PRERENDER_PROCESSES', 2))] + args
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode:
+        LOGGER.error('Unable to pre-render pages: {}'.format(result.stderr.decode('utf-8', 'replace')))
+
+
+def prerender_in_background(pks):
+    """
+    Re-render the Content pages ``pks`` with the prerender_pages command and
+    its pool of ``PRERENDER_PROCESSES`` worker processes, so that publishing
+    doesn't wait for them.
+    """
+    if pks:
+        args = ['--pages', ','.join(str(pk) for pk in sorted(pks))]
+        # Waited for from a thread, so the finished process is reaped.
+        threading.Thread(target=run_prerender_pages, args=(args,), daemon=True).start()
+
+
+_rerender = {'running': False, 'again': False}
+_rerender_lock = threading.Lock()
+
+
+def rerender_all():
+    """
+    Remove every pre-rendered page, e.g. when the menus shown on all of them
+    have changed, and render the live pages again in the background. The web
+    server falls back to the application meanwhile. Calls made while a
+    re-render is running lead to one more re-render after it.
+    """
+    remove_all()
+    with _rerender_lock:
+        if _rerender['running']:
+            _rerender['again'] = True
+            return
+        _rerender['running'] = True
+
+    def run():
+        while True:
+            run_prerender_pages([])
+            with _rerender_lock:
+                if not _rerender['again']:
+                    _rerender['running'] = False
+                    return
+                _rerender['again'] = False
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,152 @@
+import atexit
+from collections import Counter
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import slugify
+import logging
+import threading
+import time
+from wagtail.search.models import Query, QueryDailyHits
+from wagtail.search.utils import MAX_QUERY_STRING_LENGTH, normalise_query_string
+
+from core.cache import FragmentCache, get_cache, hash_key
+from core.workers import BackgroundWorker
+
+LOGGER = logging.getLogger('cms')
+notfound_cache = FragmentCache('notfound')
+
+
+_slug_index = (None, {})
+
+
+def slug_index(request=None):
+    """
+    Return a dict of slug -> list of page ids for live, searchable Content
+    pages, indexed under both each page's slug and its slugified title. Kept
+    in each worker's memory until the page tree changes.
+    """
+    global _slug_index
+    from core.models import Content
+    version = notfound_cache.version(request)
+    if _slug_index[0] != version:
+        index = {}
+        pages = Content.objects.live().exclude(url_path__startswith='/home/snippets/')
+        for pk, slug, title in pages.values_list('pk', 'slug', 'title'):
+            for name in {slug, slugify(title)}:
+                index.setdefault(name, []).append(pk)
+        _slug_index = (version, index)
+    return _slug_index[1]
+
+
+def search_rate_limited(request):
+    """
+    Count a full-text search for a missing page against the client's limit of
+    ``NOTFOUND_SEARCH_RATE_LIMIT`` per minute, returning True if it is over.
+    """
+    # Only the last address was added by our proxy, the rest come from the
+    # client and could be changed to dodge the limit.
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    client = forwarded.split(',')[-1].strip() if forwarded else request.META.get('REMOTE_ADDR', '')
+    key = 'cms:notfound-rate:{}:{}'.format(hash_key(client), int(time.time() // 60))
+    cache = get_cache()
+    cache.add(key, 0, 60)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # The counter expired between add() and incr().
+        return False
+    return count > getattr(settings, 'NOTFOUND_SEARCH_RATE_LIMIT', 10)
+
+
+def query_key(query_string):
+    """Normalise ``query_string`` as Query.get does, within the length of
+    Query.query_string (lowercasing can lengthen it) and without NUL
+    characters, which PostgreSQL rejects.
+    """
+    query_string = normalise_query_string(query_string.replace('\x00', ''))
+    return query_string[:MAX_QUERY_STRING_LENGTH].strip()
+
+
+def write_query_hits(hits):
+    """
+    Add a Counter of ``(query_string, date) -> hits`` to the search query
+    daily hits, creating any missing queries, in a few bulk statements.
+    """
+    query_strings = {query_string for query_string, date in hits}
+    Query.objects.bulk_create(
+        [Query(query_string=query_string) for query_string in query_strings],
+        ignore_conflicts=True)
+    query_ids = dict(Query.objects.filter(
+        query_string__in=query_strings).values_list('query_string', 'pk'))
+    rows = [(query_ids[query_string], date, count) for (query_string, date), count in hits.items()]
+
+    if connection.vendor == 'postgresql':
+        table = QueryDailyHits._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {0} (query_id, date, hits) VALUES {1} '
+                'ON CONFLICT (query_id, date) DO UPDATE SET hits = {0}.hits + EXCLUDED.hits'.format(
+                    table, ', '.join(['(%s, %s, %s)'] * len(rows))),
+                [value for row in rows for value in row])
+    else:
+        with transaction.atomic():
+            for query_id, date, count in rows:
+                QueryDailyHits.objects.get_or_create(query_id=query_id, date=date)
+                QueryDailyHits.objects.filter(query_id=query_id, date=date).update(
+                    hits=F('hits') + count)
+
+
+class QueryHitBuffer(object):
+    """
+    Counts search query hits in memory and writes them to the database in
+    bulk from a background thread every ``SEARCH_HITS_FLUSH_INTERVAL``
+    seconds, and when the worker exits, so that recording a hit never writes
+    on the request path. If a batch fails to write, its queries are written
+    one at a time, and those that still fail stay buffered until a later
+    flush writes them. While the database is unavailable, hits of queries
+    beyond the first ``SEARCH_HITS_MAX_QUERIES`` buffered are not counted.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self.worker = BackgroundWorker(
+            self.flush, 'SEARCH_HITS_FLUSH_INTERVAL', 30, 'Unable to record search query hits')
+
+    def add(self, query_string):
+        key = (query_key(query_string), timezone.now().date())
+        with self._lock:
+            if key not in self._hits and len(self._hits) >= getattr(settings, 'SEARCH_HITS_MAX_QUERIES', 10000):
+                LOGGER.warning('Not recording a hit of search query {!r}: too many queries buffered'.format(key[0]))
+                return
+            self._hits[key] += 1
+        self.worker.start()
+
+    def flush(self):
+        with self._lock:
+            hits, self._hits = self._hits, Counter()
+        if not hits:
+            return
+        try:
+            write_query_hits(hits)
+        except Exception:
+            LOGGER.exception('Unable to record {} search query hits'.format(sum(hits.values())))
+            self.retry(hits)
+
+    def retry(self, hits):
+        """Write ``hits`` a query at a time, keeping those that fail for the
+        next flush.
+        """
+        failed = Counter()
+        for key, count in hits.items():
+            try:
+                write_query_hits(Counter({key: count}))
+            except Exception:
+                failed[key] = count
+        with self._lock:
+            self._hits.update(failed)
+
+
+query_hits = QueryHitBuffer()
+atexit.register(query_hits.flush)
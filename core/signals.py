@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from wagtail.core.models import Page, PageRevision
+from wagtail.core.signals import page_published, page_unpublished, post_page_move
+from wagtail.documents import get_document_model
+from wagtail.images import get_image_model
+
+from core.blocks import block_cache
+from core.dependencies import affected_pages, affects_menus, published_state, shown_on_every_page
+from core.images import generate_in_background
+from core.indexing import connect_signals
+from core.menus import menu_cache
+from core.models import Content, RevisionPath
+from core import prerender
+from core.pagecache import page_cache
+from core.search import notfound_cache
+from core.snippets import snippet_cache
+
+
+@receiver(pre_save)
+def content_saving(sender, instance, update_fields=None, **kwargs):
+    # Keep the state being replaced by a full save (as when publishing) so
+    # that the pages depending on it can be found afterwards.
+    if isinstance(instance, Content) and instance.pk and update_fields is None:
+        instance._published_state = published_state(instance)
+
+
+@receiver(page_published)
+def update_content(sender, instance, **kwargs):
+    if isinstance(instance, Content):
+        instance.update_dependencies()
+        instance.update_excerpt()
+
+
+@receiver(page_published)
+def page_published_changed(sender, instance, **kwargs):
+    """Publishing invalidates the rendered menus, included content and missing
+    page lookups. Cached responses are purged (and pre-rendered pages
+    re-rendered) for the pages depending on the published page, or for every
+    page if the menus or the content included by the site's templates (e.g.
+    the footer) may have changed.
+    """
+    for cache in (menu_cache, snippet_cache, notfound_cache):
+        cache.bump()
+    previous = getattr(instance, '_published_state', None)
+    if previous is None or previous['slug'] != instance.slug:
+        # Rich text linking to the page renders its URL.
+        block_cache.bump()
+    affected = None
+    if isinstance(instance, Content) and not affects_menus(instance, previous):
+        affected = affected_pages(instance, previous)
+        if shown_on_every_page(affected, previous):
+            affected = None
+    if affected is not None:
+        Content.objects.filter(pk__in=affected).update(
+            cache_generation=F('cache_generation') + 1)
+        if getattr(settings, 'PRERENDER_ON_PUBLISH', False):
+            # Otherwise the web server serves the stale static files until the
+            # re-render gets to them.
+            for page in Content.objects.filter(pk__in=affected):
+                prerender.remove_page(page)
+            transaction.on_commit(lambda: prerender.prerender_in_background(affected))
+    else:
+        page_cache.bump()
+        if getattr(settings, 'PRERENDER_ON_PUBLISH', False):
+            transaction.on_commit(prerender.rerender_all)
+
+
+@receiver(page_unpublished)
+@receiver(post_page_move)
+def page_tree_changed(sender, instance, **kwargs):
+    """Any other change to the live page tree invalidates the rendered menus,
+    included content, missing page lookups and every cached or pre-rendered
+    page.
+    """
+    for cache in (menu_cache, snippet_cache, notfound_cache, page_cache, block_cache):
+        cache.bump()
+    if getattr(settings, 'PRERENDER_ON_PUBLISH', False):
+        transaction.on_commit(prerender.rerender_all)
+
+
+@receiver(post_delete)
+def page_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        page_tree_changed(sender, instance)
+
+
+@receiver(post_save, sender=get_image_model())
+@receiver(post_delete, sender=get_image_model())
+@receiver(post_save, sender=get_document_model())
+@receiver(post_delete, sender=get_document_model())
+def media_changed(sender, instance, **kwargs):
+    """Rich text embedding an image or linking to a document renders its
+    URL, so cached blocks are invalidated along with the pages showing them.
+    """
+    if kwargs.get('created'):
+        # Nothing links to it yet.
+        if sender is get_image_model():
+            transaction.on_commit(lambda: generate_in_background(instance.pk))
+        return
+    for cache in (block_cache, snippet_cache, page_cache):
+        cache.bump()
+
+
+@receiver(post_save, sender=PageRevision)
+def revision_saved(sender, instance, created, **kwargs):
+    if created:
+        RevisionPath.for_revision(instance).save()
+
+
+# Search index updates are queued, if the search backends don't update as
+# objects are saved.
+connect_signals()
@@ -0,0 +1,184 @@
+from django.conf import settings
+
+from core.cache import FragmentCache
+
+
+snippet_cache = FragmentCache('snippet')
+
+
+def _request_memo(request, name):
+    memo = getattr(request, name, None)
+    if memo is None:
+        memo = {}
+        if request is not None:
+            setattr(request, name, memo)
+    return memo
+
+
+def include_graph(request=None):
+    """
+    Return the include graph as a dict of page slug -> set of included slugs,
+    built from the edges stored at publish time. Cached until the page tree
+    changes.
+    """
+    from core.models import ContentInclude
+    graph = getattr(request, '_include_graph', None)
+    if graph is not None:
+        return graph
+    key = snippet_cache.make_key(request, 'graph')
+    graph = snippet_cache.get(key)
+    if graph is None:
+        graph = {}
+        for slug, included in ContentInclude.objects.values_list('page__slug', 'slug'):
+            graph.setdefault(slug, set()).add(included)
+        snippet_cache.set(key, graph)
+    if request is not None:
+        request._include_graph = graph
+    return graph
+
+
+def include_closure(slug, graph):
+    """Return every slug reachable through includes from ``slug``.
+    """
+    seen, pending = set(), [slug]
+    while pending:
+        for included in graph.get(pending.pop(), ()):
+            if included not in seen:
+                seen.add(included)
+                pending.append(included)
+    return seen
+
+
+def find_include_cycle(slug, included, graph=None):
+    """
+    Return a list of slugs describing a path through ``included`` that leads
+    back to ``slug``, or None. Used to reject include loops in the editor.
+    """
+    if graph is None:
+        graph = include_graph()
+    pending = [(child, [slug, child]) for child in sorted(included)]
+    seen = set()
+    while pending:
+        current, path = pending.pop()
+        if current == slug:
+            return path
+        if current in seen:
+            continue
+        seen.add(current)
+        for child in sorted(graph.get(current, ())):
+            pending.append((child, path + [child]))
+    return None
+
+
+def prefetch_snippets(request, slugs):
+    """Fetch the Content pages for ``slugs`` in one query and memoise them for
+    the request, so that nested includes don't query one at a time.
+    """
+    from core.models import Content
+    memo = _request_memo(request, '_snippets')
+    pages = _request_memo(request, '_snippet_pages')
+    slugs = [slug for slug in slugs if slug not in memo]
+    if not slugs:
+        return
+    found, duplicated = {}, set()
+    for page in Content.objects.filter(slug__in=slugs):
+        if page.slug in found:
+            duplicated.add(page.slug)
+        found[page.slug] = page
+    for slug, page in found.items():
+        # A duplicated slug is left to resolve_snippet to report.
+        if slug not in duplicated:
+            memo[slug] = (page.pk, page.live_revision_id)
+            pages[page.pk] = page
+
+
+def resolve_snippet(request, slug):
+    """
+    Return ``(page_id, revision_id)`` for the Content page with the given
+    slug, where ``revision_id`` is None if the page has never been published.
+    The slug lookup is memoised for the request and cached across requests
+    until the page tree changes. Raises the usual model exceptions if the slug
+    doesn't match one page.
+    """
+    from core.models import Content
+    memo = _request_memo(request, '_snippets')
+    if slug in memo:
+        return memo[slug]
+
+    key = snippet_cache.make_key(request, 'slug', slug)
+    ref = snippet_cache.get(key)
+    if ref is None:
+        page = Content.objects.get(slug=slug)
+        ref = (page.pk, page.live_revision_id)
+        snippet_cache.set(key, ref)
+        _request_memo(request, '_snippet_pages')[page.pk] = page
+    memo[slug] = ref
+    return ref
+
+
+def _render_error(context, template, slug, error, truncated=True):
+    state = context.get('include_state')
+    if truncated and state is not None:
+        state['truncated'] = True
+    return template.render(context.new({
+        'self': None,
+        'error': '{}: {}'.format(slug, error),
+        'request': context.get('request'),
+    }))
+
+
+def render_snippet(context, slug, page=None):
+    """
+    Render ``core/tags/include_content.html`` for the Content page with the
+    given slug, included by the body of ``page`` or by a template, caching the
+    HTML per site, page revision and remaining include depth. Pages that have never been published have no revision to key on,
+    so aren't cached.
+
+    Includes deeper than ``INCLUDE_CONTENT_MAX_DEPTH`` or looping back to a
+    page already being rendered are replaced with an error, and anything
+    containing such an error is not cached.
+    """
+    from core.models import Content
+    request = context.get('request')
+    template = context.template.engine.get_template('core/tags/include_content.html')
+    stack = context.get('include_stack')
+    if stack is None:
+        # The outermost include. One in the body of ``page`` starts from it,
+        # but the site templates' includes (e.g. the footer) are outside of
+        # any page body.
+        stack = (page.slug,) if page else ()
+    if slug in stack:
+        return _render_error(context, template, slug, 'Included content loops back on itself')
+    depth = getattr(settings, 'INCLUDE_CONTENT_MAX_DEPTH', 5) - len(stack)
+    if depth < 0:
+        return _render_error(context, template, slug, 'Included content is nested too deeply')
+    try:
+        page_id, revision_id = resolve_snippet(request, slug)
+    except Exception as e:
+        return _render_error(context, template, slug, e, truncated=False)
+
+    html = key = None
+    if revision_id is not None:
+        site = getattr(request, 'site', None)
+        key = snippet_cache.make_key(
+            request, 'html', getattr(site, 'pk', None), page_id, revision_id, depth)
+        html = snippet_cache.get(key)
+    if html is None:
+        page = _request_memo(request, '_snippet_pages').get(page_id)
+        if page is None:
+            page = Content.objects.get(pk=page_id)
+        prefetch_snippets(request, include_closure(slug, include_graph(request)))
+        state = {'truncated': False}
+        html = template.render(context.new({
+            'self': page,
+            'request': request,
+            'include_stack': stack + (slug,),
+            'include_state': state,
+        }))
+        if state['truncated']:
+            parent_state = context.get('include_state')
+            if parent_state is not None:
+                parent_state['truncated'] = True
+        elif key is not None:
+            snippet_cache.set(key, html)
+    return html
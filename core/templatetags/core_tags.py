@@ -1,40 +1,92 @@
 from django import template
 from django.shortcuts import render_to_response
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from functools import lru_cache
 import json
+import re
+
+from core.blocks import body_blocks as render_body_blocks
+from core.instrumentation import timed
+from core.menus import menu_children, page_ancestors, render_menu
+from core.snippets import render_snippet
 
 register = template.Library()
 
 
 @register.filter
+@timed
 def get_excerpt(page):
+    if getattr(page, 'excerpt', None):
+        return page.excerpt
     result = render_to_response('core/tags/include_content.html', context={
         "self": page,
         "embed": True})
     return result.content
 
 
-@register.inclusion_tag('core/tags/include_content.html', takes_context=True)
-def include_content(context, value):
-    from core.models import Content
-    try:
-        page = Content.objects.get(slug=value)
-    except Exception as e:
-        page = None
-        context.update({"error": "{}: {}".format(value, e)})
-    context.update({"self": page})
-    return context
+@register.filter
+@timed
+def highlight(text, query, length=300):
+    """
+    Return an extract of ``text`` of about ``length`` characters, starting
+    near the first term of ``query`` it contains, with every matching term
+    wrapped in <mark>.
+    """
+    text = text or ''
+    terms = [re.escape(term) for term in (query or '').split() if len(term) > 1]
+    pattern = re.compile('|'.join(terms), re.IGNORECASE) if terms else None
+    match = pattern.search(text) if pattern else None
+    start = max(match.start() - length // 4, 0) if match else 0
+    if start:
+        start = text.find(' ', start) + 1 or start
+    extract = text[start:start + length]
+    parts, end = [], 0
+    for match in (pattern.finditer(extract) if pattern else ()):
+        parts.append(escape(extract[end:match.start()]))
+        parts.append('<mark>{}</mark>'.format(escape(match.group())))
+        end = match.end()
+    parts.append(escape(extract[end:]))
+    return mark_safe('{}{}{}'.format(
+        '&hellip; ' if start else '', ''.join(parts),
+        ' &hellip;' if start + length < len(text) else ''))
+
+
+# Renders the static blocks of a page's body, cached per block
+@register.simple_tag(takes_context=True)
+@timed
+def body_blocks(context, page):
+    return render_body_blocks(context, page)
+
+
+# Renders the body of the Content page with the slug given, cached until
+# the page tree changes. Includes in a page body pass the page, to stop it
+# including itself
+@register.simple_tag(takes_context=True)
+@timed
+def include_content(context, value, page=None):
+    return render_snippet(context, value, page)
+
+
+@lru_cache(maxsize=256)
+def parse_content_list(value):
+    val = json.loads(value)
+    return tuple(val["tags"].split(",")), int(val["limit"])
 
 
 @register.inclusion_tag('core/tags/content_list.html', takes_context=True)
+@timed
 def content_list(context, value):
     from core.models import Content
     try:
-        val = json.loads(value)
-        tags, limit = val["tags"].split(","), int(val["limit"])
-        if not tags[0]:  # if tags is blank string return all items
-            pages = Content.objects.all()[:limit]
-        else:
-            pages = Content.objects.filter(tags__name__in=tags).distinct()[:limit]
+        tags, limit = parse_content_list(value)
+        # The body is only needed for pages without a stored excerpt.
+        # Tags are prefetched through the ParentalKey as prefetching the
+        # ClusterTaggableManager itself still queries once per page.
+        pages = Content.objects.defer('body').prefetch_related('tagged_items__tag')
+        if tags[0]:  # if tags is blank string return all items
+            pages = pages.filter(tags__name__in=tags).distinct()
+        pages = list(pages[:limit])
     except Exception as e:
         pages = None
         context.update({"error": "{}: {}".format(value, e)})
@@ -49,90 +101,48 @@ def get_site_root(context):
     return context['request'].site.root_page
 
 
-def has_menu_children(page):
-    return page.get_children().live().in_menu().exists()
-
-
-@register.simple_tag()
-def page_menuitems(x):
-    menuitems = []
-    while x:
-        menuitems.append(x)
-        x = x.get_parent()
-
-    if menuitems:
-        menuitems.pop()
-    menuitems.reverse()
-    return menuitems
+@register.simple_tag(takes_context=True)
+@timed
+def page_menuitems(context, x):
+    return page_ancestors(context.get('request'), x)
 
 
 @register.inclusion_tag('core/tags/breadcrumbs.html', takes_context=True)
+@timed
 def breadcrumbs(context, calling_page):
-    x = calling_page
-    menuitems = []
-    while x:
-        menuitems.append(x)
-        x = x.get_parent()
-
-    if menuitems:
-        menuitems.pop()
-    menuitems.reverse()
     return {
-        'menuitems': menuitems,
+        'menuitems': page_ancestors(context['request'], calling_page),
         'request': context['request']
     }
 
 
 # Retrieves the top menu items - the immediate children of the parent page
-# The has_menu_children method is necessary because the bootstrap menu requires
+# The show_dropdown flag is necessary because the bootstrap menu requires
 # a dropdown class to be applied to a parent
-@register.inclusion_tag('core/tags/f6_top_menu.html', takes_context=True)
+# The rendered menu is cached until the page tree changes
+@register.simple_tag(takes_context=True)
+@timed
 def f6_top_menu(context, parent, calling_page=None):
-    menuitems = parent.get_children().live().in_menu()
-    for menuitem in menuitems:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (calling_page.url.startswith(menuitem.url)
-                           if calling_page else False)
-    return {
-        'calling_page': calling_page,
-        'menuitems': menuitems,
-        # required by the pageurl tag that we want to use within this template
-        'request': context['request'],
-    }
+    return render_menu(context, 'core/tags/f6_top_menu.html', parent, calling_page)
 
 
 # Retrieves the top menu items - the immediate children of the parent page
-# The has_menu_children method is necessary because the bootstrap menu requires
+# The show_dropdown flag is necessary because the bootstrap menu requires
 # a dropdown class to be applied to a parent
-@register.inclusion_tag('core/tags/top_menu.html', takes_context=True)
+# The rendered menu is cached until the page tree changes
+@register.simple_tag(takes_context=True)
+@timed
 def top_menu(context, parent, calling_page=None):
-    menuitems = parent.get_children().live().in_menu()
-    for menuitem in menuitems:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (calling_page.url.startswith(menuitem.url)
-                           if calling_page else False)
-    return {
-        'calling_page': calling_page,
-        'menuitems': menuitems,
-        # required by the pageurl tag that we want to use within this template
-        'request': context['request'],
-    }
+    return render_menu(context, 'core/tags/top_menu.html', parent, calling_page)
 
 
 # Retrieves the children of the top menu items for the drop downs
 @register.inclusion_tag('core/tags/f6_top_menu_children.html', takes_context=True)
+@timed
 def f6_top_menu_children(context, parent, vertical):
-    menuitems_children = parent.get_children().live().in_menu()
-
-    # This would help to create multilevel nav bars
-    for menuitem in menuitems_children:
-        menuitem.show_dropdown = has_menu_children(menuitem)
+    # show_dropdown is set on each child by the menu tree, which would help
+    # to create multilevel nav bars
+    menuitems_children = menu_children(context['request'], parent)
 
     return {
         'vertical': vertical,
@@ -145,12 +155,11 @@ def f6_top_menu_children(context, parent, vertical):
 
 # Retrieves the children of the top menu items for the drop downs
 @register.inclusion_tag('core/tags/top_menu_children.html', takes_context=True)
+@timed
 def top_menu_children(context, parent):
-    menuitems_children = parent.get_children().live().in_menu()
-
-    # This would help to create multilevel nav bars
-    for menuitem in menuitems_children:
-        menuitem.show_dropdown = has_menu_children(menuitem)
+    # show_dropdown is set on each child by the menu tree, which would help
+    # to create multilevel nav bars
+    menuitems_children = menu_children(context['request'], parent)
 
     return {
         'parent': parent,
@@ -161,5 +170,6 @@ def top_menu_children(context, parent):
 
 
 @register.inclusion_tag('core/tags/mobile_menu_children.html', takes_context=True)
+@timed
 def mobile_menu_children(context, parent):
     return top_menu_children(context, parent)
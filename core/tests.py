@@ -0,0 +1,456 @@
+from collections import Counter
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import DatabaseError, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+import json
+import os
+import tempfile
+from unittest import mock
+from wagtail.core.models import Site
+from wagtail.search.models import QueryDailyHits
+
+from core.dependencies import template_snippets
+from core.menus import menu_cache, menu_children, page_ancestors
+from core.models import Content, OutboxEmail
+from core.outbox import outbox, queue_email, send_pending
+from core.pagecache import CSRF_PLACEHOLDER, cacheable, page_cache
+from core.prerender import page_directory, prerender_page
+from core.search import QueryHitBuffer, write_query_hits
+from core.snippets import prefetch_snippets, resolve_snippet, snippet_cache
+from oim_cms.middleware import SiteResolver, XsSharing
+
+
+class CoreTestCase(TestCase):
+    def setUp(self):
+        # Fragment cache versions are rolled back with each test's database.
+        cache.clear()
+        self.site = Site.objects.get(is_default_site=True)
+        self.home = self.site.root_page
+        self.factory = RequestFactory()
+
+    def add_page(self, parent, slug, body='[]', **kwargs):
+        kwargs.setdefault('show_in_menus', True)
+        page = parent.add_child(instance=Content(title=slug.title(), slug=slug, body=body, **kwargs))
+        page.save_revision().publish()
+        return Content.objects.get(pk=page.pk)
+
+    def request(self, path='/'):
+        request = self.factory.get(path)
+        request.site = self.site
+        return request
+
+
+class MenuTreeTests(CoreTestCase):
+    def setUp(self):
+        super(MenuTreeTests, self).setUp()
+        self.sections = [self.add_page(self.home, 'section-{}'.format(i)) for i in range(3)]
+        for section in self.sections:
+            for j in range(2):
+                self.add_page(section, '{}-{}'.format(section.slug, j))
+        self.add_page(self.sections[0], 'hidden', show_in_menus=False)
+
+    def test_one_query_per_tree(self):
+        request = self.request()
+        with self.assertNumQueries(1):
+            top = menu_children(request, self.home)
+            children = [menu_children(request, section) for section in top]
+        self.assertEqual([page.slug for page in top], ['section-0', 'section-1', 'section-2'])
+        self.assertEqual([page.slug for page in children[0]], ['section-0-0', 'section-0-1'])
+        self.assertTrue(all(page.show_dropdown for page in top))
+        self.assertFalse(any(page.show_dropdown for page in children[0]))
+
+
+class MenuCacheTests(CoreTestCase):
+    template = Template('{% load core_tags %}{% f6_top_menu parent=parent %}')
+
+    def setUp(self):
+        super(MenuCacheTests, self).setUp()
+        self.first = self.add_page(self.home, 'first')
+        self.second = self.add_page(self.home, 'second')
+
+    def render(self):
+        return self.template.render(Context({'request': self.request(), 'parent': self.home}))
+
+    def test_cached(self):
+        self.render()
+        hits = menu_cache.hits
+        self.render()
+        self.assertEqual(menu_cache.hits, hits + 1)
+
+    def test_publish(self):
+        self.render()
+        self.add_page(self.home, 'third')
+        self.assertIn('Third', self.render())
+
+    def test_unpublish(self):
+        self.render()
+        self.second.unpublish()
+        self.assertNotIn('Second', self.render())
+
+    def test_move(self):
+        before = self.render()
+        self.second.move(self.first, pos='last-child')
+        # Second is now in First's dropdown.
+        self.assertNotEqual(self.render(), before)
+
+    def test_delete(self):
+        self.render()
+        self.second.delete()
+        self.assertNotIn('Second', self.render())
+
+
+class BreadcrumbTests(CoreTestCase):
+    def test_one_query(self):
+        section = self.add_page(self.home, 'section')
+        child = self.add_page(section, 'child')
+        page = self.add_page(child, 'page')
+        request = self.request()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [p.pk for p in page_ancestors(request, page)], [self.home.pk, section.pk, child.pk, page.pk])
+            page_ancestors(request, page)
+
+    def test_without_page(self):
+        # Templates such as search results render breadcrumbs without a page.
+        request = self.request()
+        self.assertEqual(page_ancestors(request, ''), [])
+        Template('{% load core_tags %}{% breadcrumbs self %}').render(Context({'request': request}))
+
+
+def rich_text(text):
+    return json.dumps([{'type': 'rich_text', 'value': '<p>{}</p>'.format(text)}])
+
+
+class SnippetTests(CoreTestCase):
+    template = Template('{% load core_tags %}{% include_content "snippet" %}')
+
+    def render(self):
+        return self.template.render(Context({'request': self.request()}))
+
+    def test_cached_until_published(self):
+        snippet = self.add_page(self.home, 'snippet', body=rich_text('First version'))
+        self.assertIn('First version', self.render())
+        hits = snippet_cache.hits
+        self.assertIn('First version', self.render())
+        self.assertGreater(snippet_cache.hits, hits)
+        snippet.body = rich_text('Second version')
+        snippet.save_revision().publish()
+        self.assertIn('Second version', self.render())
+
+    def test_never_published(self):
+        snippet = self.home.add_child(instance=Content(title='Snippet', slug='snippet', body=rich_text('Draft')))
+        self.assertIn('Draft', self.render())
+        snippet.body = rich_text('Edited')
+        snippet.save()
+        self.assertIn('Edited', self.render())
+
+
+def include(slug):
+    return json.dumps([{'type': 'include_content', 'value': slug}])
+
+
+class IncludeCycleTests(CoreTestCase):
+    def test_clean_rejects_cycle(self):
+        first = self.add_page(self.home, 'first', body=include('second'))
+        self.add_page(self.home, 'second', body=include('third'))
+        third = self.add_page(self.home, 'third')
+        third.body = include('first')
+        with self.assertRaisesMessage(ValidationError, 'third > first > second > third'):
+            third.clean()
+        first.body = include('third')
+        first.clean()
+
+
+class DraftTests(CoreTestCase):
+    def test_any_case(self):
+        page = self.add_page(self.home, 'Mixed-Case')
+        page.save_revision()
+        for path in ('/draft/Mixed-Case/', '/draft/mixed-case'):
+            response = self.client.get(path)
+            self.assertRedirects(
+                response, '/admin/pages/{}/view_draft/'.format(page.pk), fetch_redirect_response=False)
+
+
+class DependencyTests(CoreTestCase):
+    def test_template_snippets(self):
+        self.assertTrue({'footer', 'f6-footer'} <= template_snippets())
+
+    def test_footer_purges_every_page(self):
+        page = self.add_page(self.home, 'page', show_in_menus=False)
+        footer = self.add_page(self.home, 'f6-footer', body=rich_text('Footer'), show_in_menus=False)
+        version = page_cache.version()
+        footer.body = rich_text('New footer')
+        footer.save_revision().publish()
+        self.assertEqual(page_cache.version(), version + 1)
+        # Other pages only purge the pages depending on them.
+        page.save_revision().publish()
+        self.assertEqual(page_cache.version(), version + 1)
+
+
+class SiteResolverTests(CoreTestCase):
+    def test_checked_every_interval(self):
+        resolver = SiteResolver()
+        self.assertEqual(resolver.find_for_request(self.factory.get('/')).pk, self.site.pk)
+        with self.assertNumQueries(0):
+            resolver.find_for_request(self.factory.get('/', HTTP_HOST='other.example'))
+
+    @override_settings(SITE_RESOLVER_INTERVAL=0)
+    def test_other_worker_sees_changes(self):
+        # A resolver in another worker process, whose map isn't cleared by
+        # this one's signal handlers.
+        resolver = SiteResolver()
+        self.assertEqual(resolver.find_for_request(self.factory.get('/')).pk, self.site.pk)
+        other = Site.objects.create(hostname='other.example', root_page=self.home)
+        request = self.factory.get('/', HTTP_HOST='other.example')
+        with self.assertNumQueries(2):
+            self.assertEqual(resolver.find_for_request(request).pk, other.pk)
+        with self.assertNumQueries(1):
+            resolver.find_for_request(self.factory.get('/', HTTP_HOST='other.example'))
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionRefusedError('Relay unavailable')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(CoreTestCase):
+    def queue(self):
+        return queue_email('Subject', '<p>Body</p>', 'from@example.com', ['to@example.com'], html=True)
+
+    def test_queued_in_request(self):
+        user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(user)
+        page = self.add_page(self.home, 'form')
+        with mock.patch.object(outbox, 'wake') as wake:
+            response = self.client.post(page.url, {'Subject': 'Request'})
+        self.assertEqual(response.status_code, 200)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.recipients, 'user@example.com')
+        # Not sent during the request, and the sender is only woken once the
+        # request's transaction commits (which the test's never does).
+        self.assertEqual(mail.outbox, [])
+        wake.assert_not_called()
+
+    def test_rolled_back(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.queue()
+                raise RuntimeError
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_send_pending(self):
+        email = self.queue()
+        self.assertEqual(send_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['to@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>Body</p>', 'text/html')])
+        email.refresh_from_db()
+        self.assertIsNotNone(email.sent)
+        # Sent emails aren't sent again.
+        self.assertEqual(send_pending(), 0)
+
+    @override_settings(EMAIL_OUTBOX_RETRY_DELAY=60, EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        email = self.queue()
+        send_pending(FailingBackend())
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertIsNone(email.sent)
+        self.assertIn('Relay unavailable', email.last_error)
+        self.assertGreater(email.next_attempt, timezone.now() + timedelta(seconds=50))
+        # Not due again yet.
+        self.assertEqual(send_pending(), 0)
+
+        OutboxEmail.objects.update(next_attempt=timezone.now())
+        send_pending(FailingBackend())
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        # Given up on after EMAIL_OUTBOX_MAX_ATTEMPTS.
+        OutboxEmail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(send_pending(), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class IncludeTests(CoreTestCase):
+    def test_serve_footer(self):
+        # The base template includes the footer page, within itself.
+        self.add_page(self.home, 'f6-footer', body=rich_text('Footer text'), show_in_menus=False)
+        response = self.client.get('/f6-footer/')
+        self.assertContains(response, 'Footer text')
+        self.assertNotContains(response, 'loops back')
+
+    def test_include_self(self):
+        # As from the page's own body.
+        page = self.add_page(self.home, 'page')
+        html = Template('{% load core_tags %}{% include_content "page" page %}').render(
+            Context({'request': self.request(), 'page': page}))
+        self.assertIn('Included content loops back on itself', html)
+
+    def test_duplicated_slug(self):
+        for parent in [self.home] + [self.add_page(self.home, 'section-{}'.format(i)) for i in range(2)]:
+            self.add_page(parent, 'snippet')
+        request = self.request()
+        prefetch_snippets(request, ['snippet'])
+        with self.assertRaises(Content.MultipleObjectsReturned):
+            resolve_snippet(request, 'snippet')
+
+
+class QueryHitTests(CoreTestCase):
+    def hits(self):
+        return dict(QueryDailyHits.objects.values_list('query__query_string', 'hits'))
+
+    def test_write_query_hits(self):
+        today = timezone.now().date()
+        write_query_hits(Counter({('cats', today): 2, ('dogs', today): 1}))
+        write_query_hits(Counter({('cats', today): 3}))
+        self.assertEqual(self.hits(), {'cats': 5, 'dogs': 1})
+
+    def test_failed_flush(self):
+        buffer = QueryHitBuffer()
+        with mock.patch.object(buffer.worker, 'start'):
+            buffer.add('Cats')
+            buffer.add('cats ')
+            with self.assertLogs('cms', 'ERROR'):
+                with mock.patch('core.search.write_query_hits', side_effect=DatabaseError):
+                    buffer.flush()
+            self.assertEqual(self.hits(), {})
+            # Kept until written.
+            buffer.add('dogs')
+            buffer.flush()
+        self.assertEqual(self.hits(), {'cats': 2, 'dogs': 1})
+
+
+class NotFoundTests(CoreTestCase):
+    def test_redirect_to_slug(self):
+        section = self.add_page(self.home, 'section')
+        self.assertEqual(self.client.get('/target/').status_code, 404)
+        # Both the cached result and the slug index are refreshed on publish.
+        self.add_page(section, 'target')
+        self.assertRedirects(self.client.get('/target/'), '/section/target/', fetch_redirect_response=False)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTests(CoreTestCase):
+    def setUp(self):
+        super(PageCacheTests, self).setUp()
+        self.page = self.add_page(self.home, 'page', body=rich_text('First version'))
+
+    def request(self, path='/page/', method='get', **kwargs):
+        request = getattr(self.factory, method)(path, **kwargs)
+        request.site = self.site
+        request.user = AnonymousUser()
+        return request
+
+    def test_hit(self):
+        self.page.serve(self.request())
+        request = self.request()
+        # Cache versions are looked up once per request.
+        page_cache.version(request)
+        with self.assertNumQueries(0):
+            response = self.page.serve(request)
+        self.assertContains(response, 'First version')
+
+    def test_csrf_token(self):
+        for i in range(2):
+            response = self.client.get('/page/')
+            self.assertNotContains(response, CSRF_PLACEHOLDER)
+            self.assertContains(response, 'csrfmiddlewaretoken')
+            self.assertIn('csrftoken', response.cookies)
+
+    def test_not_modified(self):
+        etag = self.client.get('/page/')['ETag']
+        response = self.client.get('/page/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_uncacheable(self):
+        self.assertTrue(cacheable(self.request(data={'fullscreen': '1'})))
+        request = self.request()
+        request.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        self.assertFalse(cacheable(request))
+        self.assertFalse(cacheable(self.request(method='post')))
+        request = self.request()
+        request.is_preview = True
+        self.assertFalse(cacheable(request))
+        self.assertFalse(cacheable(self.request(data={'utm_source': 'email'})))
+
+    def test_publish(self):
+        self.client.get('/page/')
+        self.page.body = rich_text('Second version')
+        self.page.save_revision().publish()
+        self.assertContains(self.client.get('/page/'), 'Second version')
+
+
+class PrerenderTests(CoreTestCase):
+    def test_publish_removes_page(self):
+        page = self.add_page(self.home, 'page', body=rich_text('First version'), show_in_menus=False)
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(PRERENDER_ROOT=root, PRERENDER_ON_PUBLISH=True):
+                self.assertTrue(prerender_page(page))
+                path = os.path.join(page_directory(page), 'index.html')
+                self.assertTrue(os.path.exists(path))
+                page.body = rich_text('Second version')
+                page.save_revision().publish()
+                # Before it is rendered again, once the publish commits.
+                self.assertFalse(os.path.exists(path))
+
+
+@override_settings(XS_SHARING_ALLOWED_ORIGINS=['https://app.example', 'https://*.dbca.wa.gov.au'])
+class XsSharingTests(CoreTestCase):
+    def setUp(self):
+        super(XsSharingTests, self).setUp()
+        self.view = mock.Mock(side_effect=lambda request: HttpResponse())
+
+    def get(self, origin, **kwargs):
+        return XsSharing(self.view)(self.factory.get('/', HTTP_ORIGIN=origin, **kwargs))
+
+    def test_allowed_origin(self):
+        response = self.get('https://app.example')
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://app.example')
+        self.assertEqual(response['Access-Control-Allow-Credentials'], 'true')
+        self.assertEqual(response['Vary'], 'Origin')
+
+    def test_wildcard_subdomain(self):
+        response = self.get('https://cms.dbca.wa.gov.au')
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://cms.dbca.wa.gov.au')
+        self.assertFalse(self.get('https://a.b.dbca.wa.gov.au').has_header('Access-Control-Allow-Origin'))
+
+    @override_settings(XS_SHARING_ALLOWED_ORIGINS='*')
+    def test_any_origin(self):
+        response = self.get('https://other.example')
+        self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+        self.assertFalse(response.has_header('Access-Control-Allow-Credentials'))
+
+    def test_disallowed_origin(self):
+        response = self.get('https://other.example')
+        self.assertFalse(response.has_header('Access-Control-Allow-Origin'))
+        self.assertFalse(response.has_header('Access-Control-Allow-Methods'))
+
+    @override_settings(XS_SHARING_MAX_AGE=600)
+    def test_preflight(self):
+        request = self.factory.options(
+            '/', HTTP_ORIGIN='https://app.example', HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST')
+        response = XsSharing(self.view)(request)
+        self.assertEqual(response['Access-Control-Max-Age'], '600')
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://app.example')
+        self.view.assert_not_called()
+
+
+class HealthCheckTests(CoreTestCase):
+    def test_liveness(self):
+        self.assertEqual(self.client.get('/healthcheck/').json(), {'status': 'HEALTHY'})
+
+    def test_stats(self):
+        body = self.client.get('/healthcheck/?stats&ready').json()
+        self.assertEqual(body['status'], 'HEALTHY')
+        self.assertIn('page', body['worker']['fragment_caches'])
+        self.assertEqual(set(body['checks']), {'database', 'cache'})
@@ -1,12 +1,18 @@
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Count, OuterRef, Subquery, Window
 from django.http import HttpResponseRedirect, HttpResponse
 from django.shortcuts import render
 from django.utils.safestring import mark_safe
-from django.views.generic import TemplateView
 from wagtail.core import hooks
 from wagtail.core.models import PageRevision
-from wagtail.search.models import Query
-from core.models import Content
+from core.cache import hash_key
+from core.instrumentation import timer
+from core.models import Content, RevisionPath
+from core.outbox import queue_email
+from core.search import notfound_cache, query_hits, search_rate_limited, slug_index
+
+SEARCH_RESULTS_PER_PAGE = 20
 
 
 def draft(request, path):
@@ -16,15 +22,19 @@ def draft(request, path):
         path = "/" + path + "/"
     else:
         path = "/"
-    revisions = PageRevision.objects.filter(
-        content_json__icontains='"url_path": "/home{}"'.format(path)).order_by("-created_at")
-    if revisions.exists() and revisions[
-            0].page.get_latest_revision().pk == revisions[0].pk:
+    # The latest revision with this URL, whether it's the latest revision of
+    # its page, and how many revisions have had this URL, in one query.
+    revision = RevisionPath.objects.filter(url_path="/home{}".format(path.lower())).annotate(
+        total=Window(Count('pk')),
+        page_latest=Subquery(PageRevision.objects.filter(page_id=OuterRef('page_id')).order_by(
+            '-created_at', '-id').values('pk')[:1]),
+    ).order_by('-created_at', '-revision_id').first()
+    if revision and revision.page_latest == revision.pk:
         return HttpResponseRedirect("/admin/pages/{}/view_draft/{}".format(
-            revisions[0].page.pk, request.META.get("QUERY_STRING")))
-    elif revisions.exists():
+            revision.page_id, request.META.get("QUERY_STRING")))
+    elif revision:
         return HttpResponse(
-            "No current draft ({} old) exists for url: {}".format(revisions.count(), path))
+            "No current draft ({} old) exists for url: {}".format(revision.total, path))
     else:
         return HttpResponse("No draft exists for url: {}".format(path))
 
@@ -38,39 +48,88 @@ def search_content(search_query):
     # Search
     search_results = Content.objects.live().exclude(
         url_path__startswith="/home/snippets/").search(search_query)
-    query = Query.get(search_query)
-    # Record hit
-    query.add_hit()
+    # Record hit (written in bulk by a background thread)
+    query_hits.add(search_query)
     return search_results
 
 
+def paginate_results(request, search_results):
+    """Return the requested page of search results, counted once and
+    evaluated once.
+    """
+    page = Paginator(search_results, SEARCH_RESULTS_PER_PAGE).get_page(request.GET.get('page'))
+    page.object_list = list(page.object_list)
+    return page
+
+
 def search(request):
     search_query = request.GET.get('q', None)
-    if search_query:
-        search_results = search_content(search_query)
-    else:
-        search_results = Content.objects.none()
+    with timer('search'):
+        if search_query:
+            search_results = search_content(search_query)
+        else:
+            search_results = Content.objects.none()
+        search_results = paginate_results(request, search_results)
 
     return render(request, 'core/search_results.html', {
         'search_results': search_results,
+        'search_query': search_query,
     })
 
 
+# Requests for these are probes for software we don't run, not for pages.
+PROBE_SUFFIXES = ('.php', '.asp', '.aspx', '.jsp', '.cgi', '.env', '.sql', '.bak', '.xml', '.txt')
+PROBE_PREFIXES = ('wp-', '.')
+
+
+def not_found_result(request, path):
+    """
+    Work out the response to a request for a missing page as either
+    ``('redirect', url)`` or ``('results', [page ids])``, trying cheap lookups
+    before a full-text search. Returns None if the client is over its search
+    rate limit.
+    """
+    segments = [segment for segment in path.split('/') if segment]
+    if not segments or segments[-1].endswith(PROBE_SUFFIXES) or segments[-1].startswith(PROBE_PREFIXES):
+        return ('results', [])
+    pks = slug_index(request).get(segments[-1], [])
+    if len(pks) == 1:
+        return ('redirect', Content.objects.get(pk=pks[0]).url)
+    if search_rate_limited(request):
+        return None
+
+    search_results = paginate_results(request, search_content(' '.join(segments)))
+    if search_results.paginator.count == 1:
+        return ('redirect', search_results[0].url)
+    return ('results', [page.pk for page in search_results])
+
+
 def error404(request, exception=None):
-    search_query = " ".join(request.get_full_path().split("/"))
-    search_results = search_content(search_query)
-    if search_results.count() == 1:
-        return HttpResponseRedirect(search_results[0].url)
-    else:
-        response = HttpResponse(
-            content=render(request, 'core/search_results.html', {
-                'search_results': search_results,
-                'http_error_code': 404
-            }).content,
-            content_type='text/html; charset=utf-8',
-            status=404
-        )
-        return response
+    # Results are cached per normalised path until the page tree changes, or
+    # for a while, since search results also change as pages are edited.
+    path = request.path.lower()
+    key = notfound_cache.make_key(request, 'path', hash_key(path))
+    result = notfound_cache.get(key)
+    if result is None:
+        result = not_found_result(request, path)
+        if result is not None:
+            notfound_cache.set(key, result, getattr(settings, 'NOTFOUND_CACHE_SECONDS', 3600))
+    if result and result[0] == 'redirect':
+        return HttpResponseRedirect(result[1])
+
+    pks = result[1] if result else []
+    pages = Content.objects.in_bulk(pks)
+    search_results = Paginator([pages[pk] for pk in pks if pk in pages], SEARCH_RESULTS_PER_PAGE).get_page(1)
+    response = HttpResponse(
+        content=render(request, 'core/search_results.html', {
+            'search_results': search_results,
+            'search_query': ' '.join(segment for segment in path.split('/') if segment),
+            'http_error_code': 404
+        }).content,
+        content_type='text/html; charset=utf-8',
+        status=404
+    )
+    return response
 
 
 @hooks.register('before_serve_page')
@@ -98,19 +157,8 @@ def submit_form(page, request, serve_args, serve_kwargs):
             {'subject': subject, 'email': True, 'postdata': postdata, 'instructions': instructions}
         )
         email = response.content.decode('utf-8')
-        send_mail(
+        # Sent in the background, so a slow mail relay doesn't hold up the response.
+        queue_email(
             '{} ( {} )'.format(subject, request.path), email, 'OIM Service Desk <oim.servicedesk@dbca.wa.gov.au>',
-            [request.user.email], html_message=email, fail_silently=False)
+            [request.user.email], html=True)
         return response
-
-
-class HealthCheckView(TemplateView):
-    """A basic template view not requiring auth, used for service monitoring.
-    """
-    template_name = 'healthcheck.html'
-
-    def get_context_data(self, **kwargs):
-        context = super(HealthCheckView, self).get_context_data(**kwargs)
-        context['page_title'] = 'OIM CMS application status'
-        context['status'] = 'HEALTHY'
-        return context
@@ -0,0 +1,10 @@
+from wagtail.core import hooks
+
+from core.images import PrefetchedImageEmbedHandler
+
+
+# Replaces wagtail.images' handler for <embed embedtype="image">, so ordered
+# after it.
+@hooks.register('register_rich_text_features', order=1)
+def register_image_embed_handler(features):
+    features.register_embed_type(PrefetchedImageEmbedHandler)
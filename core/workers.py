@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db import connection, connections
+import logging
+from multiprocessing import Pool
+import os
+import threading
+
+LOGGER = logging.getLogger('cms')
+
+
+def run_in_background(func, *args):
+    """Call ``func(*args)`` from a daemon thread, so that the request or
+    signal handler starting it doesn't wait for it.
+    """
+    def run():
+        try:
+            func(*args)
+        finally:
+            # This thread's database connection would otherwise stay open.
+            connection.close()
+    threading.Thread(target=run, daemon=True).start()
+
+
+class BackgroundWorker(object):
+    """
+    Calls ``task`` from a background thread in each worker process, when
+    woken and every ``interval_setting`` seconds, so that the requests
+    leading to it don't wait for it. Failures are logged, and the task is
+    run again at the next interval.
+    """
+    def __init__(self, task, interval_setting, default_interval, error):
+        self.task = task
+        self.interval_setting = interval_setting
+        self.default_interval = default_interval
+        self.error = error
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._pid = None
+
+    def start(self):
+        """Start this worker process's thread, if it isn't running.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads don't survive gunicorn forking its workers.
+                self._pid = os.getpid()
+                self._event = threading.Event()
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def wake(self):
+        """Run the task now, rather than at the next interval.
+        """
+        self.start()
+        self._event.set()
+
+    def _run(self):
+        interval = getattr(settings, self.interval_setting, self.default_interval)
+        while True:
+            self._event.wait(interval)
+            self._event.clear()
+            try:
+                self.task()
+            except Exception:
+                LOGGER.exception(self.error)
+            finally:
+                # This thread's database connection would otherwise stay open.
+                connection.close()
+
+
+def run_chunks(func, pks, processes=1, chunk_size=100):
+    """
+    Call ``func`` with chunks of up to ``chunk_size`` of ``pks``, in a pool of
+    ``processes`` worker processes if there is more than one, and return the
+    sum of its results. ``func`` must be picklable to run in the pool.
+    """
+    chunks = [pks[i:i + chunk_size] for i in range(0, len(pks), chunk_size)]
+    if processes > 1:
+        # Worker processes must not share the parent's database connections.
+        connections.close_all()
+        with Pool(processes) as pool:
+            return sum(pool.imap_unordered(func, chunks))
+    return sum(func(chunk) for chunk in chunks)
@@ -1,18 +1,104 @@
 from django import http
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.http.request import split_domain_port
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+import re
+import time
 from wagtail.core.models import Site
 
-try:
-    from django.conf import settings
-    XS_SHARING_ALLOWED_ORIGINS = settings.XS_SHARING_ALLOWED_ORIGINS
-    XS_SHARING_ALLOWED_METHODS = settings.XS_SHARING_ALLOWED_METHODS
-    XS_SHARING_ALLOWED_HEADERS = settings.XS_SHARING_ALLOWED_HEADERS
-    XS_SHARING_ALLOWED_CREDENTIALS = settings.XS_SHARING_ALLOWED_CREDENTIALS
-except AttributeError:
-    XS_SHARING_ALLOWED_ORIGINS = '*'
-    XS_SHARING_ALLOWED_METHODS = ['POST', 'GET', 'OPTIONS', 'PUT', 'DELETE']
-    XS_SHARING_ALLOWED_HEADERS = ['Content-Type', '*']
-    XS_SHARING_ALLOWED_CREDENTIALS = 'true'
+from core import health
+from core.cache import bump_version, load_version
+
+
+class HealthCheckMiddleware(object):
+    """
+    Counts the requests served by this worker, and answers health checks
+    before any other middleware (sessions, authentication, SSO) runs. See
+    core.health.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.path = reverse('health_check')
+
+    def __call__(self, request):
+        health.count_request()
+        if request.path_info == self.path:
+            return health.healthcheck(request)
+        return self.get_response(request)
+
+
+class SiteResolver(object):
+    """
+    Resolves requests to Sites from a per-worker map of the Site table, with
+    the same rules as ``Site.find_for_request``, so that finding the site
+    doesn't cost a query of its own. Saving or deleting a Site bumps a shared
+    version (see core.cache), which each worker checks at most every
+    ``SITE_RESOLVER_INTERVAL`` seconds, rebuilding its map when it changes.
+    """
+    name = 'site'
+
+    def __init__(self):
+        self._sites = None
+        self._matches = {}
+        self._version = None
+        self._checked = None
+
+    def clear(self, **kwargs):
+        self._sites = None
+        bump_version(self.name)
+
+    def sites(self):
+        now = time.monotonic()
+        if self._sites is None or now - self._checked >= getattr(settings, 'SITE_RESOLVER_INTERVAL', 10):
+            version = load_version(self.name)
+            self._checked = now
+            if self._sites is None or version != self._version:
+                self._version = version
+                self._matches = {}
+                self._sites = list(Site.objects.values(
+                    'pk', 'hostname', 'port', 'site_name', 'root_page_id', 'is_default_site'))
+        return self._sites
+
+    def match(self, hostname, port):
+        """Return the field values of the Site for ``hostname`` and ``port``,
+        or None.
+        """
+        sites = self.sites()
+        if (hostname, port) not in self._matches:
+            def rank(site):
+                if site['hostname'] == hostname and site['port'] == port:
+                    return 0
+                if site['hostname'] == hostname and site['is_default_site']:
+                    return 1
+                return 2 if site['is_default_site'] else 3
+
+            candidates = sorted(
+                (s for s in sites if s['hostname'] == hostname or s['is_default_site']), key=rank)
+            site = None
+            if len(candidates) == 1 or candidates and rank(candidates[0]) < 2:
+                site = candidates[0]
+            elif candidates and rank(candidates[0]) == 2:
+                # A single hostname match beats the default site.
+                site = candidates[len(candidates) == 2]
+            self._matches[(hostname, port)] = site
+        return self._matches[(hostname, port)]
+
+    def find_for_request(self, request):
+        port = request.get_port()
+        values = self.match(split_domain_port(request.get_host())[0], int(port) if port.isdigit() else None)
+        if values is None:
+            return None
+        # Each request gets its own instance, as the Site caches its root page.
+        return Site(id=values['pk'], **{name: value for name, value in values.items() if name != 'pk'})
+
+
+site_resolver = SiteResolver()
+post_save.connect(site_resolver.clear, sender=Site)
+post_delete.connect(site_resolver.clear, sender=Site)
 
 
 class SiteMiddleware(MiddlewareMixin):
@@ -20,37 +106,70 @@ class SiteMiddleware(MiddlewareMixin):
     def process_request(self, request):
         """
         Set request.site to contain the Site object responsible for handling this request.
+        The Site is only looked up when it is used, and Wagtail's own lookups reuse it.
         """
-        try:
-            request.site = Site.find_for_request(request)
-        except Site.DoesNotExist:
-            request.site = None
+        request.site = request._wagtail_site = SimpleLazyObject(lambda: site_resolver.find_for_request(request))
 
 
 class XsSharing(object):
     """
-    This middleware allows cross-domain XHR using the HTML5 postMessage API.
+    This middleware allows cross-domain XHR from the origins in
+    XS_SHARING_ALLOWED_ORIGINS, either '*', or a list of origins which may
+    contain wildcard subdomains such as 'https://*.dbca.wa.gov.au'. Header
+    values are computed once, when the middleware is loaded. Preflight
+    requests are answered directly, and may be cached by the browser for
+    XS_SHARING_MAX_AGE seconds.
 
     Access-Control-Allow-Origin: http://foo.example
     Access-Control-Allow-Methods: POST, GET, OPTIONS, PUT, DELETE
 
     Based off https://gist.github.com/426829
     """
-    def process_request(self, request):
-        if 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in request.META:
-            response = http.HttpResponse()
-            response['Access-Control-Allow-Origin'] = XS_SHARING_ALLOWED_ORIGINS
-            response['Access-Control-Allow-Methods'] = ",".join(XS_SHARING_ALLOWED_METHODS)
-            response['Access-Control-Allow-Headers'] = ",".join(XS_SHARING_ALLOWED_HEADERS)
-            response['Access-Control-Allow-Credentials'] = XS_SHARING_ALLOWED_CREDENTIALS
-            return response
+    def __init__(self, get_response):
+        self.get_response = get_response
+        origins = getattr(settings, 'XS_SHARING_ALLOWED_ORIGINS', '*')
+        if isinstance(origins, str):
+            origins = [origins]
+        self.any_origin = '*' in origins
+        self.origins = frozenset(origin for origin in origins if '*' not in origin)
+        patterns = [re.escape(origin).replace(r'\*', '[^./]+') for origin in origins if '*' in origin and origin != '*']
+        self.origin_pattern = re.compile('|'.join(patterns)) if patterns else None
 
-        return None
+        credentials = getattr(settings, 'XS_SHARING_ALLOWED_CREDENTIALS', 'true')
+        self.headers = {
+            'Access-Control-Allow-Methods': ','.join(getattr(
+                settings, 'XS_SHARING_ALLOWED_METHODS', ['POST', 'GET', 'OPTIONS', 'PUT', 'DELETE'])),
+            'Access-Control-Allow-Headers': ','.join(getattr(
+                settings, 'XS_SHARING_ALLOWED_HEADERS', ['Content-Type', '*'])),
+        }
+        # Browsers refuse credentials with a wildcard origin, so any origin
+        # not listed explicitly gets '*' without credentials.
+        self.credential_headers = dict(self.headers, **{'Access-Control-Allow-Credentials': credentials})
+        self.preflight_headers = {'Access-Control-Max-Age': str(getattr(settings, 'XS_SHARING_MAX_AGE', 86400))}
 
-    def process_response(self, request, response):
-        response['Access-Control-Allow-Origin'] = XS_SHARING_ALLOWED_ORIGINS
-        response['Access-Control-Allow-Methods'] = ",".join(XS_SHARING_ALLOWED_METHODS)
-        response['Access-Control-Allow-Headers'] = ",".join(XS_SHARING_ALLOWED_HEADERS)
-        response['Access-Control-Allow-Credentials'] = XS_SHARING_ALLOWED_CREDENTIALS
+    def allowed_origin(self, origin):
+        return origin in self.origins or (
+            self.origin_pattern is not None and self.origin_pattern.fullmatch(origin) is not None)
 
+    def add_headers(self, request, response):
+        origin = request.META.get('HTTP_ORIGIN')
+        if origin and self.allowed_origin(origin):
+            response['Access-Control-Allow-Origin'] = origin
+            headers = self.credential_headers
+        elif self.any_origin:
+            response['Access-Control-Allow-Origin'] = '*'
+            headers = self.headers
+        else:
+            headers = {}
+        for header, value in headers.items():
+            response[header] = value
+        patch_vary_headers(response, ('Origin',))
         return response
+
+    def __call__(self, request):
+        if request.method == 'OPTIONS' and 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in request.META:
+            response = self.add_headers(request, http.HttpResponse())
+            for header, value in self.preflight_headers.items():
+                response[header] = value
+            return response
+        return self.add_headers(request, self.get_response(request))
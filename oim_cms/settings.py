@@ -44,11 +44,13 @@ INSTALLED_APPS = [
     'core',
 ]
 MIDDLEWARE = [
+    'oim_cms.middleware.HealthCheckMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.instrumentation.InstrumentationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'oim_cms.middleware.SiteMiddleware',
@@ -111,6 +113,14 @@ MEDIA_URL = '/media/'
 # Email settings
 EMAIL_HOST = env('EMAIL_HOST', 'email.host')
 EMAIL_PORT = env('EMAIL_PORT', 25)
+# Send queued form emails from a thread in each worker (see core.outbox),
+# rather than only with the send_outbox command.
+EMAIL_OUTBOX_THREAD = env('EMAIL_OUTBOX_THREAD', True)
+# Seconds between retries of unsent emails; doubled after each failure.
+EMAIL_OUTBOX_RETRY_DELAY = env('EMAIL_OUTBOX_RETRY_DELAY', 60)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env('EMAIL_OUTBOX_MAX_ATTEMPTS', 8)
+# Seconds between checks of the outbox for emails due a retry.
+EMAIL_OUTBOX_INTERVAL = env('EMAIL_OUTBOX_INTERVAL', 60)
 
 # Wagtail settings
 WAGTAIL_SITE_NAME = 'OIM Content Management System'
@@ -119,10 +129,49 @@ WAGTAILSEARCH_BACKENDS = {
     'default': {
         'BACKEND': 'wagtail.contrib.postgres_search.backend',
         'SEARCH_CONFIG': 'english',
+        # Updates are queued and applied in batches, see core.indexing.
+        'AUTO_UPDATE': False,
     },
 }
 WAGTAIL_USAGE_COUNT_ENABLED = True
 WAGTAILSEARCH_RESULTS_TEMPLATE = 'core/search_results.html'
+# Time requests' SQL, templates and template tags, see core.instrumentation.
+INSTRUMENTATION_ENABLED = env('INSTRUMENTATION_ENABLED', False)
+# Log the timings of requests taking at least this many milliseconds.
+INSTRUMENTATION_SLOW_MS = env('INSTRUMENTATION_SLOW_MS', 500)
+# Fraction of requests to profile with cProfile, as well as staff requests with ?profile.
+INSTRUMENTATION_PROFILE_RATE = env('INSTRUMENTATION_PROFILE_RATE', 0.0)
+INSTRUMENTATION_PROFILE_DIR = env('INSTRUMENTATION_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+# Seconds allowed for each readiness probe, and between probes, see core.health.
+HEALTHCHECK_TIMEOUT = env('HEALTHCHECK_TIMEOUT', 2)
+HEALTHCHECK_CACHE_SECONDS = env('HEALTHCHECK_CACHE_SECONDS', 10)
+# Seconds between each worker's checks for changed Sites, see SiteResolver.
+SITE_RESOLVER_INTERVAL = env('SITE_RESOLVER_INTERVAL', 10)
+# Cache whole Content pages served to anonymous visitors.
+PAGE_CACHE_ENABLED = env('PAGE_CACHE_ENABLED', False)
+# Create the rich text format renditions of images when they are uploaded.
+RENDITIONS_ON_UPLOAD = env('RENDITIONS_ON_UPLOAD', True)
+# Static copies of live pages for the web server, see core.prerender.
+PRERENDER_ROOT = env('PRERENDER_ROOT', os.path.join(BASE_DIR, 'prerendered'))
+# Re-render affected static pages when a page is published.
+PRERENDER_ON_PUBLISH = env('PRERENDER_ON_PUBLISH', False)
+# Worker processes re-rendering static pages in the background after a publish.
+PRERENDER_PROCESSES = env('PRERENDER_PROCESSES', 2)
+# Apply queued search index updates from a thread in each worker, every
+# SEARCH_INDEX_INTERVAL seconds and shortly after objects are saved.
+SEARCH_INDEX_THREAD = env('SEARCH_INDEX_THREAD', True)
+SEARCH_INDEX_INTERVAL = env('SEARCH_INDEX_INTERVAL', 60)
+SEARCH_INDEX_BATCH_SIZE = env('SEARCH_INDEX_BATCH_SIZE', 500)
+# Seconds between bulk writes of buffered search query hits.
+SEARCH_HITS_FLUSH_INTERVAL = env('SEARCH_HITS_FLUSH_INTERVAL', 30)
+# Distinct search queries whose hits are buffered while they fail to write.
+SEARCH_HITS_MAX_QUERIES = env('SEARCH_HITS_MAX_QUERIES', 10000)
+# Seconds the response to a request for a missing page is cached for.
+NOTFOUND_CACHE_SECONDS = env('NOTFOUND_CACHE_SECONDS', 3600)
+# Full-text searches per client per minute for requests for missing pages.
+NOTFOUND_SEARCH_RATE_LIMIT = env('NOTFOUND_SEARCH_RATE_LIMIT', 10)
+# Maximum nesting of include_content blocks rendered within a page.
+INCLUDE_CONTENT_MAX_DEPTH = env('INCLUDE_CONTENT_MAX_DEPTH', 5)
 # Base URL to use when referring to full URLs within the Wagtail admin backend
 # e.g. in notification emails. Don't include '/admin' or a trailing slash
 BASE_URL = env('BASE_URL', 'https://oim.dbca.wa.gov.au')
@@ -6,7 +6,7 @@ from wagtail.admin import urls as wagtailadmin_urls
 from wagtail.documents import urls as wagtaildocs_urls
 from wagtail.core import urls as wagtail_urls
 
-from core import views
+from core import health, views
 
 admin.site.site_header = 'OIM CMS Database Administration'
 
@@ -15,7 +15,7 @@ urlpatterns = [
     path('documents/', include(wagtaildocs_urls)),
     path('django-admin/', admin.site.urls),
     re_path(r'^draft/(?P<path>.*)', views.draft, name='draft'),
-    path('healthcheck/', views.HealthCheckView.as_view(), name='health_check'),
+    path('healthcheck/', health.healthcheck, name='health_check'),
     path('search', views.search, name='search'),
     path('redirect/', views.redirect, name='redirect'),
     path('', include(wagtail_urls)),
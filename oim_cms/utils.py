@@ -1,11 +1,67 @@
-from django.http import HttpResponse
-from djqscsv import render_to_csv_response
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from djqscsv import generate_filename
 from restless.dj import DjangoResource
+import csv
+import datetime
+import zlib
+
+
+class Echo(object):
+    """Just enough of a file for csv.writer, returning what it writes.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    # As djqscsv writes values.
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_stream(rows, fields, headers, chunk_size):
+    """
+    Yield a CSV as byte strings: a BOM (for Excel) with the ``headers`` row,
+    then the ``fields`` of the dicts from the ``rows`` iterator,
+    ``chunk_size`` rows at a time.
+    """
+    writer = csv.writer(Echo())
+    yield b'\xef\xbb\xbf' + writer.writerow(headers).encode('utf-8')
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow([csv_value(row[field]) for field in fields]))
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+def gzip_stream(chunks):
+    """Compress an iterable of byte strings into a gzip stream, flushing
+    after each one so that the client gets the header row straight away,
+    then each chunk of rows.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
 
 
 class CSVDjangoResource(DjangoResource):
     """Extend the restless DjangoResource class to add a CSV export endpoint.
+
+    The ``VALUES_ARGS`` of the list queryset are streamed as CSV as they are
+    read from the database, ``CSV_CHUNK_SIZE`` rows at a time. Set
+    ``CSV_GZIP`` to compress it on the fly for clients that accept gzip.
     """
+    CSV_CHUNK_SIZE = 2000
+    CSV_GZIP = False
+
     @classmethod
     def as_csv(self, request):
         resource = self()
@@ -13,8 +69,37 @@ class CSVDjangoResource(DjangoResource):
             return HttpResponse(
                 "list_qs not implemented for {}".format(self.__name__))
         resource.request = request
-        return render_to_csv_response(
-            resource.list_qs(), field_order=resource.VALUES_ARGS)
+        fields = resource.VALUES_ARGS
+        qs = resource.list_qs().values(*fields)
+        # Model fields are headed with their verbose names, as djqscsv does.
+        names = {field.name: str(field.verbose_name) for field in qs.model._meta.fields}
+        content = csv_stream(
+            qs.iterator(chunk_size=self.CSV_CHUNK_SIZE), fields,
+            [names.get(field, field) for field in fields], self.CSV_CHUNK_SIZE)
+
+        if self.CSV_GZIP and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = StreamingHttpResponse(gzip_stream(content), content_type='text/csv')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename={};'.format(generate_filename(qs))
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+def is_mapping(value):
+    """Whether ``value`` is dictionary enough to be looked up by key, decided
+    once per type.
+    """
+    cls = type(value)
+    result = _mapping_types.get(cls)
+    if result is None:
+        result = _mapping_types[cls] = hasattr(cls, 'keys') and hasattr(cls, '__getitem__')
+    return result
+
+
+_mapping_types = {}
 
 
 class FieldsFormatter(object):
@@ -24,11 +109,16 @@ class FieldsFormatter(object):
         ``request`` parameter , a http request object
         ``formatters`` parameter: a dictionary of keys (a dotted lookup path to
         the desired attribute/key on the object) and values(a formatter object).
+        ``failures`` parameter: optional, a ``collections.Counter`` to count
+        the lookups that failed to format, by lookup path.
 
     For properties without a configured formatter method, return the raw value
     directly.
 
-    This method will replace the old value with formatted value.
+    This method will replace the old value with formatted value. Values that
+    fail to format are left as they are.
+
+    The lookup paths are split once, when the formatter is created.
 
     Example::
         preparer = FieldsFormatter(request, fields={
@@ -38,9 +128,16 @@ class FieldsFormatter(object):
             'photo': format_fileField,
         })
     """
-    def __init__(self, formatters):
+    def __init__(self, formatters, failures=None):
         super(FieldsFormatter, self).__init__()
         self._formatters = formatters
+        self.failures = failures
+        # (lookup, parent path, final key, formatter) for each lookup.
+        self._chains = []
+        for lookup, formatter in (formatters or {}).items():
+            if formatter:
+                parts = tuple(part for part in lookup.split('.') if part)
+                self._chains.append((lookup, parts[:-1], parts[-1] if parts else None, formatter))
 
     def format(self, request, data):
         """
@@ -50,34 +147,76 @@ class FieldsFormatter(object):
         if data:
             if isinstance(data, list):
                 # list object
-                for row in data:
-                    self.format_object(request, row)
+                self.format_list(request, data)
             else:
                 # a single object
                 self.format_object(request, data)
 
         return data
 
+    def format_list(self, request, rows):
+        """
+        format a list of objects of the same type, a field at a time.
+        """
+        if not self._chains:
+            return rows
+        mapping = is_mapping(rows[0])
+        for lookup, path, key, formatter in self._chains:
+            if key is None:
+                continue
+            if not path:
+                # Top level fields, the common case.
+                for row in rows:
+                    try:
+                        if mapping:
+                            row[key] = formatter(request, row[key])
+                        else:
+                            setattr(row, key, formatter(request, getattr(row, key)))
+                    except Exception:
+                        self.failed(lookup)
+            else:
+                for row in rows:
+                    self.apply(request, lookup, path, key, formatter, row)
+        return rows
+
     def format_object(self, request, data):
         """
         format a simgle object.
 
-        Uses the ``lookup_data`` method to traverse dotted paths.
-
         Replace the value with formatted value, if required.
 
         """
-        if not self._formatters:
+        if not self._chains:
             # No fields specified. Serialize everything.
             return data
 
-        for lookup, formatter in self._formatters.items():
-            if not formatter:
-                continue
-            data = self.format_data(request, lookup, data, formatter)
+        for lookup, path, key, formatter in self._chains:
+            if key is None:
+                data = formatter(request, data)
+            else:
+                self.apply(request, lookup, path, key, formatter, data)
 
         return data
 
+    def apply(self, request, lookup, path, key, formatter, data):
+        """
+        Descend through ``path`` from ``data`` and replace the value at
+        ``key`` with its formatted value.
+        """
+        try:
+            for part in path:
+                data = data[part] if is_mapping(data) else getattr(data, part)
+            if is_mapping(data):
+                data[key] = formatter(request, data[key])
+            else:
+                setattr(data, key, formatter(request, getattr(data, key)))
+        except Exception:
+            self.failed(lookup)
+
+    def failed(self, lookup):
+        if self.failures is not None:
+            self.failures[lookup] += 1
+
     def format_data(self, request, lookup, data, formatter):
         """
         Given a lookup string, attempts to descend through nested data looking for
@@ -116,36 +255,5 @@ class FieldsFormatter(object):
         if not parts or not parts[0]:
             return formatter(request, data)
 
-        part = parts[0]
-        remaining_lookup = '.'.join(parts[1:])
-
-        if hasattr(data, 'keys') and hasattr(data, '__getitem__'):
-            # Dictionary enough for us.
-            try:
-                value = data[part]
-                if remaining_lookup:
-                    # is an object
-                    self.format_data(
-                        request, remaining_lookup, value, formatter)
-                else:
-                    # is a simple type value
-                    data[part] = formatter(request, value)
-            except:
-                # format failed, ignore
-                pass
-        else:
-            try:
-                value = getattr(data, part)
-                # Assume it's an object.
-                if remaining_lookup:
-                    # is an object
-                    self.format_data(
-                        request, remaining_lookup, value, formatter)
-                else:
-                    # is a simple type value
-                    setattr(data, part, formatter(request, value))
-            except:
-                # format failed, ignore
-                pass
-
+        self.apply(request, lookup, parts[:-1], parts[-1], formatter, data)
         return data